@@ -0,0 +1,248 @@
+"""Нагрузочный бенчмарк бота на фейковом Telegram.
+
+Гоняет start, button_handler и handle_message синтетическими обновлениями от тысяч
+пользователей и печатает задержки (p50/p99), пропускную способность и конкуренцию за БД.
+
+Запуск: python benchmark.py --users 2000 --latency 0.02 > bench_output.txt
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import Counter
+
+# БД бенчмарка — во временной папке, до импорта бота
+BENCH_DIR = tempfile.mkdtemp(prefix='bench_')
+os.environ['DB_PATH'] = os.path.join(BENCH_DIR, 'bench.db')
+os.environ.setdefault('BOT_TOKEN', '123456:bench')
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+import bot
+
+TOURNAMENTS = 5
+# id модераторов для сценария со списком участников
+MODERATORS = 10 ** 8
+
+class FakeTelegram(BaseRequest):
+    """Подменяет Telegram API: записывает вызовы и отвечает с заданной задержкой"""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, params):
+        self._message_id += 1
+        chat_id = int(params.get('chat_id', 1))
+        return {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': params.get('text') or params.get('caption') or '',
+        }
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        params = request_data.parameters if request_data else {}
+        if endpoint == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif endpoint.startswith(('send', 'edit')):
+            result = self._message(params)
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+class Simulator:
+    """Синтетические обновления от пользователей и замер времени их обработки"""
+    def __init__(self, application):
+        self.application = application
+        self.processor = application.update_processor
+        self._update_id = 0
+        self.latencies = []
+
+    def _user(self, user_id):
+        # Пользователь 0 — админ (роль выдается миграцией по ADMIN_CHAT_ID)
+        return {'id': user_id or bot.ADMIN_CHAT_ID, 'is_bot': False, 'first_name': 'U', 'username': f'user{user_id}'}
+
+    def _message(self, user_id, text):
+        message = {
+            'message_id': self._update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id or bot.ADMIN_CHAT_ID, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return message
+
+    def message(self, user_id, text):
+        self._update_id += 1
+        return Update.de_json({'update_id': self._update_id, 'message': self._message(user_id, text)}, self.application.bot)
+
+    def callback(self, user_id, data):
+        self._update_id += 1
+        return Update.de_json({
+            'update_id': self._update_id,
+            'callback_query': {
+                'id': str(self._update_id),
+                'from': self._user(user_id),
+                'chat_instance': 'bench',
+                'data': data,
+                'message': self._message(user_id, 'bench'),
+            },
+        }, self.application.bot)
+
+    async def send(self, update):
+        """Обрабатывает обновление так же, как Application при concurrent_updates"""
+        started = time.perf_counter()
+        await self.processor.process_update(update, self.application.process_update(update))
+        self.latencies.append(time.perf_counter() - started)
+
+    async def run(self, name, users, scenario):
+        self.latencies = []
+        wait_before = _db_wait()
+        started = time.perf_counter()
+        await asyncio.gather(*(scenario(self, user_id) for user_id in users))
+        elapsed = time.perf_counter() - started
+        report(name, self.latencies, elapsed, _db_wait(wait_before))
+
+def _db_wait(before=None):
+    """Суммарное время ожидания потока БД и число запросов (из метрик бота)"""
+    total, count = 0.0, 0
+    for (name, _), (_, seconds, calls) in bot.metrics._histograms.items():
+        if name == 'bot_db_queue_wait_seconds':
+            total += seconds
+            count += calls
+    if before:
+        return total - before[0], count - before[1]
+    return total, count
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+def report(name, latencies, elapsed, db_wait):
+    wait_total, queries = db_wait
+    print(
+        f"{name:<14} updates={len(latencies):<6} "
+        f"p50={percentile(latencies, 0.50) * 1000:7.2f}ms "
+        f"p99={percentile(latencies, 0.99) * 1000:7.2f}ms "
+        f"throughput={len(latencies) / elapsed:8.0f}/s "
+        f"db_queries={queries:<6} db_wait_avg={wait_total / queries * 1000 if queries else 0:6.3f}ms"
+    )
+
+async def browse(sim, user_id):
+    tournament_id = f"tournament_{user_id % TOURNAMENTS + 1}"
+    for update in (
+        sim.message(user_id, '/start'),
+        sim.callback(user_id, bot.cb('menu')),
+        sim.callback(user_id, bot.cb('tournaments')),
+        sim.callback(user_id, bot.cb('t', tournament_id)),
+        sim.callback(user_id, bot.cb('tournaments')),
+        sim.callback(user_id, bot.cb('my_games')),
+    ):
+        await sim.send(update)
+
+async def register(sim, user_id):
+    tournament_id = f"tournament_{user_id % TOURNAMENTS + 1}"
+    await sim.send(sim.callback(user_id, bot.cb('reg', tournament_id)))
+    await sim.send(sim.message(user_id, f"#nick{user_id} и id{user_id}"))
+
+async def page_participants(sim, user_id):
+    # Модератор листает список участников турнира (у каждого свой аккаунт: обновления
+    # одного пользователя идут по очереди, а лишние сверх UPDATE_KEY_PENDING отбрасываются)
+    moderator_id = MODERATORS + user_id
+    tournament_id = f"tournament_{user_id % TOURNAMENTS + 1}"
+    await sim.send(sim.callback(moderator_id, bot.cb('pl', tournament_id)))
+    for page in range(1, 5):
+        # Курсор — любая регистрация: страница начинается сразу после неё
+        cursor_id = page * bot.PARTICIPANTS_PAGE_SIZE * TOURNAMENTS
+        await sim.send(sim.callback(
+            moderator_id, bot.cb('pl', tournament_id, page * bot.PARTICIPANTS_PAGE_SIZE + 1, 'n', cursor_id)
+        ))
+
+def bench_router(iterations=200000):
+    """Стоимость разбора callback_data и поиска маршрута"""
+    payloads = [
+        bot.cb('tournaments'), bot.cb('t', 'tournament_1'), bot.cb('pl', 'tournament_1', 21, 'n', 55),
+        # Кнопки без версии и старого формата из уже отправленных сообщений
+        't:tournament_1', 'register_tournament_1',
+    ]
+    for payload in payloads:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            bot.router.parse(payload)
+        elapsed = time.perf_counter() - started
+        print(f"router.parse {payload!r:<32} {elapsed / iterations * 1e9:7.0f} ns")
+
+async def bench_registrations(count):
+    """Регистрации напрямую через слой БД, без Telegram"""
+    tournament_id = await bot.db.add_tournament('Bench', '', '', '', '', count)
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        bot.db.add_registration(tournament_id, 10 ** 6 + i, None, f'n{i}', f'g{i}') for i in range(count + 100)
+    ))
+    elapsed = time.perf_counter() - started
+    registered = sum(success for success, _ in results)
+    tournament = await bot.db.get_tournament(tournament_id)
+    print(
+        f"registrations  {count + 100} attempts in {elapsed:.2f}s ({(count + 100) / elapsed:.0f}/s), "
+        f"registered={registered}, counter={tournament['participants']}, limit={count}"
+    )
+
+async def main(args):
+    # Метрики нужны бенчмарку для замера ожидания БД
+    bot.metrics = bot.Metrics()
+    telegram = FakeTelegram(args.latency)
+    application = bot.build_application(request=telegram)
+    await application.initialize()
+    bot.admin_notifier.start(application.bot)
+
+    # В свежей БД id выдаются по порядку: tournament_1 ... tournament_TOURNAMENTS
+    for i in range(1, TOURNAMENTS + 1):
+        await bot.db.add_tournament(f"Турнир {i}", "Бенчмарк", "01.01.2030", "0", "0", args.users)
+
+    print(f"users={args.users} api_latency={args.latency * 1000:.0f}ms workers={bot.UPDATE_WORKERS} db={os.environ['DB_PATH']}")
+    sim = Simulator(application)
+    users = range(1, args.users + 1)
+    await sim.run('browse', users, browse)
+    await sim.run('register', users, register)
+    staff = range(1, TOURNAMENTS * 4 + 1)
+    for user_id in staff:
+        await bot.roles.grant(MODERATORS + user_id, bot.ROLE_MODERATOR)
+    await sim.run('participants', staff, page_participants)
+
+    await bench_registrations(args.registrations)
+    bench_router()
+
+    await bot.admin_notifier.stop(application.bot)
+    await application.shutdown()
+    print(f"api_calls {dict(telegram.calls)}")
+    print(f"catalog_cache {bot.db.cache_stats()}")
+    print(f"view_cache skipped_edits={bot.views.skipped}")
+    print(f"update_processor {application.update_processor.stats()}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000, help='число симулируемых пользователей')
+    parser.add_argument('--latency', type=float, default=0.01, help='задержка фейкового Telegram API, сек')
+    parser.add_argument('--registrations', type=int, default=5000, help='мест в турнире для теста регистраций')
+    try:
+        asyncio.run(main(parser.parse_args()))
+    finally:
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
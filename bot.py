@@ -1,7 +1,27 @@
 import sqlite3
 import logging
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
+import asyncio
+import csv
+import io
+import json
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict, deque
+from functools import partial
+from telegram import (
+    InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InlineQueryResultCachedPhoto, InputFile,
+    InputMediaPhoto, InputTextMessageContent, Update
+)
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
+from telegram.ext import (
+    Application, BasePersistence, BaseUpdateProcessor, CommandHandler, CallbackQueryHandler, ContextTypes,
+    InlineQueryHandler, MessageHandler, PersistenceInput, filters
+)
 import os
 
 # Настройка логирования
@@ -14,69 +34,577 @@ logging.basicConfig(
 BOT_TOKEN = os.getenv('BOT_TOKEN', '8304708243:AAHu5pL628e45y3MmiltjE5ebsxMooAJz6E')
 ADMIN_USERNAME = "no_validxxx"
 ADMIN_CHAT_ID = 8467569113
+DB_PATH = os.getenv('DB_PATH', 'tournaments.db')
 
-class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect('tournaments.db', check_same_thread=False)
-        self.create_tables()
+# Сколько запросов к БД может одновременно ждать своей очереди
+DB_MAX_PENDING = int(os.getenv('DB_MAX_PENDING', '256'))
+# Записывать ли в лист ожидания, когда все места заняты
+WAITLIST_ENABLED = os.getenv('WAITLIST_ENABLED', '1') == '1'
+# Участников на одной странице списка
+PARTICIPANTS_PAGE_SIZE = 20
+# Лимит длины сообщения и подписи к фото в Telegram
+MESSAGE_LIMIT = 4096
+CAPTION_LIMIT = 1024
+# Сколько строк читать за раз при экспорте
+EXPORT_BATCH_SIZE = 1000
+# До какого размера файл экспорта держится в памяти, дальше уходит на диск
+EXPORT_SPOOL_SIZE = 8 * 1024 * 1024
+# Рассылка: сообщений в секунду (лимит Telegram — около 30), параллельных отправок и попыток на получателя
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', '8'))
+BROADCAST_MAX_ATTEMPTS = 5
+# Как часто сохранять прогресс рассылки в БД (в получателях)
+BROADCAST_FLUSH_EVERY = 50
+# Уведомления админам копятся и уходят сводкой раз в ADMIN_DIGEST_WINDOW секунд или по ADMIN_DIGEST_SIZE штук
+ADMIN_DIGEST_WINDOW = float(os.getenv('ADMIN_DIGEST_WINDOW', '10'))
+ADMIN_DIGEST_SIZE = int(os.getenv('ADMIN_DIGEST_SIZE', '20'))
+# Как часто (в секундах) сохранять состояние пользователей в БД
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', '5'))
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Публичный адрес для webhook (например https://bot.example.com) и параметры локального сервера
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+# Сколько принятых обновлений может ждать в очереди; при заполнении webhook и long polling ждут
+UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', '1000'))
+# Сколько обновлений обрабатывается одновременно (обновления одного пользователя — всегда по очереди)
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '16'))
+# Сколько обновлений может быть в обработке одновременно, включая ждущие своей очереди;
+# следующие остаются в очереди обновлений
+UPDATE_MAX_PENDING = int(os.getenv('UPDATE_MAX_PENDING', '256'))
+# Сколько обновлений одного пользователя может ждать; лишние отбрасываются. 0 — без ограничения
+UPDATE_KEY_PENDING = int(os.getenv('UPDATE_KEY_PENDING', '0'))
+# Пауза перед перезапуском после ошибки
+RESTART_DELAY = 10
+# Часовой пояс, в котором админ вводит дату турнира
+TIMEZONE = ZoneInfo(os.getenv('TIMEZONE', 'Europe/Moscow'))
+# Через сколько часов после начала турнир завершается автоматически
+TOURNAMENT_DURATION = float(os.getenv('TOURNAMENT_DURATION', '3'))
+# За сколько минут до начала напоминать участникам (через запятую)
+REMINDER_OFFSETS = [int(m) for m in os.getenv('REMINDER_OFFSETS', '1440,60').split(',') if m.strip()]
+# Напоминание, опоздавшее больше чем на столько секунд (бот был выключен), не отправляется
+REMINDER_GRACE = 600
+# Завершенные турниры старше стольких дней переносятся в архив
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', '7'))
+# Как часто (в секундах) запускать архивацию, сколько турниров переносить за одну транзакцию
+ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL', '3600'))
+ARCHIVE_BATCH_SIZE = 50
+# Сколько свободных страниц БД возвращать системе за один запуск архивации
+VACUUM_PAGES = 2000
+# Турниров на одной странице архива
+ARCHIVE_PAGE_SIZE = 10
+# Как часто (в секундах) проверять, не поменяли ли роли в БД в обход бота
+ROLES_RELOAD_INTERVAL = float(os.getenv('ROLES_RELOAD_INTERVAL', '30'))
+# Для скольких пользователей держать в памяти список их турниров ("Мои игры")
+USER_GAMES_CACHE_SIZE = int(os.getenv('USER_GAMES_CACHE_SIZE', '10000'))
+# Сколько ссылок на матч (турнир, пользователь) держать в памяти
+MATCH_LINKS_CACHE_SIZE = int(os.getenv('MATCH_LINKS_CACHE_SIZE', '10000'))
+# Наибольший размер файла со ссылками на матчи
+LINKS_FILE_LIMIT = 5 * 1024 * 1024
+# Сколько участников показывать в результатах поиска и до скольких считать найденных
+SEARCH_LIMIT = 20
+SEARCH_COUNT_LIMIT = 1000
+# Inline режим: сколько секунд Telegram может кэшировать ответ, сколько запросов помнить самим
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '30'))
+INLINE_MEMO_SIZE = 1000
+# Больше 50 результатов Telegram не принимает
+INLINE_RESULTS_LIMIT = 50
+# Сколько последних отрисованных сообщений помнить, чтобы не слать одинаковые правки
+VIEW_CACHE_SIZE = int(os.getenv('VIEW_CACHE_SIZE', '10000'))
+# Порт для /metrics в формате Prometheus, 0 — метрики выключены
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+# Адрес для /metrics: по умолчанию только локальный, наружу — явно через METRICS_HOST=0.0.0.0
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+# Границы корзин гистограмм задержки, в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+EXPORT_COLUMNS = [
+    'id', 'tournament_id', 'tournament_name', 'user_tg_id', 'user_tg_username',
+    'nickname', 'game_id', 'registration_date'
+]
+
+class Metrics:
+    """Счетчики и гистограммы задержек, отдаются по /metrics в текстовом формате Prometheus"""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._types = {}
+        self._counters = defaultdict(float)
+        # (имя, метки) -> [счетчики по корзинам, сумма, количество]
+        self._histograms = {}
+        self._gauges = {}
+        self._server = None
     
-    def create_tables(self):
-        cursor = self.conn.cursor()
-        
-        # Таблица турниров
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS tournaments (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                description TEXT,
-                date TEXT,
-                entry_fee TEXT,
-                prize TEXT,
-                max_participants INTEGER,
-                participants INTEGER DEFAULT 0,
-                photo_id TEXT,
-                status TEXT DEFAULT 'active'
-            )
-        ''')
-        
-        # Таблица регистраций
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS registrations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                tournament_id TEXT,
-                user_tg_id INTEGER,
-                user_tg_username TEXT,
-                nickname TEXT,
-                game_id TEXT,
-                registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (tournament_id) REFERENCES tournaments (id)
+    def inc(self, name, value=1, **labels):
+        self._types.setdefault(name, 'counter')
+        self._counters[name, tuple(labels.items())] += value
+    
+    def observe(self, name, seconds, **labels):
+        self._types.setdefault(name, 'histogram')
+        key = (name, tuple(labels.items()))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        histogram[0][bisect_left(self.buckets, seconds)] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+    
+    def gauge(self, name, func):
+        """Регистрирует показатель, значение которого берется вызовом func при каждом запросе /metrics"""
+        self._types[name] = 'gauge'
+        self._gauges[name] = func
+    
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = [*labels, *extra]
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+    
+    def render(self):
+        lines = []
+        for name, kind in sorted(self._types.items()):
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (metric, labels), value in self._counters.items():
+                    if metric == name:
+                        lines.append(f'{name}{self._labels(labels)} {value}')
+            elif kind == 'histogram':
+                for (metric, labels), (counts, total, count) in self._histograms.items():
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket in zip((*self.buckets, '+Inf'), counts):
+                        cumulative += bucket
+                        lines.append(f'{name}_bucket{self._labels(labels, [("le", bound)])} {cumulative}')
+                    lines.append(f'{name}_sum{self._labels(labels)} {total}')
+                    lines.append(f'{name}_count{self._labels(labels)} {count}')
+            else:
+                lines.append(f'{name} {self._gauges[name]()}')
+        return '\n'.join(lines) + '\n'
+    
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Остаток запроса (заголовки) не нужен, но его надо вычитать
+            while (await reader.readline()).strip():
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[1] == '/metrics':
+                status, body = '200 OK', self.render().encode()
+            else:
+                status, body = '404 Not Found', b'not found\n'
+            writer.write(
+                f'HTTP/1.1 {status}\r\n'
+                f'Content-Type: text/plain; version=0.0.4\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Connection: close\r\n\r\n'.encode() + body
             )
-        ''')
+            await writer.drain()
+        finally:
+            writer.close()
+    
+    async def start(self, port, host=METRICS_HOST):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        print(f"📈 Метрики доступны на {host}:{port}/metrics")
+    
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+# Когда метрики выключены, все точки замера сводятся к проверке metrics is not None
+metrics = Metrics() if METRICS_PORT else None
+
+def timed_handler(name, handler):
+    """Оборачивает обработчик замером времени; без метрик возвращает его как есть"""
+    if metrics is None:
+        return handler
+    
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await handler(update, context)
+        finally:
+            metrics.observe('bot_handler_seconds', time.perf_counter() - started, handler=name)
+    return wrapper
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTP-клиент бота с замером задержек запросов к Telegram API"""
+    async def do_request(self, url, method, *args, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            metrics.inc('bot_telegram_errors_total', endpoint=endpoint, error=type(e).__name__)
+            raise
+        finally:
+            metrics.observe('bot_telegram_request_seconds', time.perf_counter() - started, endpoint=endpoint)
         
-        # Таблица ссылок пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_links (
-                user_id INTEGER PRIMARY KEY,
-                match_link TEXT
-            )
-        ''')
+        if code == 429:
+            metrics.inc('bot_telegram_retry_after_total', endpoint=endpoint)
+        elif code >= 400:
+            metrics.inc('bot_telegram_errors_total', endpoint=endpoint, error=str(code))
+        return code, payload
+
+DATE_FORMATS = ('%d.%m.%Y %H:%M', '%d.%m.%Y')
+
+def fts_query(text):
+    """Превращает ввод админа в запрос FTS5: каждое слово ищется по началу, все слова обязательны"""
+    words = [word.strip('@#') for word in text.split()]
+    return ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words if word)
+
+def parse_start_time(text):
+    """Разбирает дату турнира ("15.04.2024 18:00" или "15.04.2024") в unix-время, None если не вышло"""
+    for fmt in DATE_FORMATS:
+        try:
+            return int(datetime.strptime(text.strip(), fmt).replace(tzinfo=TIMEZONE).timestamp())
+        except (AttributeError, ValueError):
+            continue
+    return None
+
+def tournament_events(starts_at):
+    """События жизненного цикла турнира: (вид, время). Напоминания — "remind:<минут до начала>" """
+    events = [('close', starts_at), ('complete', starts_at + int(TOURNAMENT_DURATION * 3600))]
+    events += [(f'remind:{minutes}', starts_at - minutes * 60) for minutes in REMINDER_OFFSETS]
+    return events
+
+def schedule_tournament(conn, tournament_id, starts_at, now=None):
+    """Записывает будущие события турнира в scheduled_events"""
+    now = time.time() if now is None else now
+    conn.executemany(
+        'INSERT OR REPLACE INTO scheduled_events (tournament_id, kind, fire_at) VALUES (?, ?, ?)',
+        [(tournament_id, kind, fire_at) for kind, fire_at in tournament_events(starts_at) if fire_at > now]
+    )
+
+def backfill_start_times(conn):
+    """Разбирает даты существующих турниров; события планируются только для ещё не начавшихся"""
+    rows = conn.execute("SELECT id, date FROM tournaments WHERE status = 'active'").fetchall()
+    now = time.time()
+    for tournament_id, date in rows:
+        starts_at = parse_start_time(date or '')
+        if starts_at is None:
+            continue
+        conn.execute('UPDATE tournaments SET starts_at = ? WHERE id = ?', (starts_at, tournament_id))
+        if starts_at > now:
+            schedule_tournament(conn, tournament_id, starts_at, now)
+
+# Миграции схемы по порядку: миграция N переводит БД на версию N (хранится в PRAGMA user_version).
+# Шаг миграции — SQL или функция, принимающая соединение.
+MIGRATIONS = [
+    # 1: исходная схема
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS tournaments (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            description TEXT,
+            date TEXT,
+            entry_fee TEXT,
+            prize TEXT,
+            max_participants INTEGER,
+            participants INTEGER DEFAULT 0,
+            photo_id TEXT,
+            status TEXT DEFAULT 'active'
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS registrations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tournament_id TEXT,
+            user_tg_id INTEGER,
+            user_tg_username TEXT,
+            nickname TEXT,
+            game_id TEXT,
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (tournament_id) REFERENCES tournaments (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_links (
+            user_id INTEGER PRIMARY KEY,
+            match_link TEXT
+        )
+        ''',
+    ],
+    # 2: лист ожидания, уникальность регистраций и индексы под горячие запросы
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS waitlist (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tournament_id TEXT,
+            user_tg_id INTEGER,
+            user_tg_username TEXT,
+            nickname TEXT,
+            game_id TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (tournament_id, user_tg_id),
+            FOREIGN KEY (tournament_id) REFERENCES tournaments (id)
+        )
+        ''',
+        # Старые БД могли накопить дубли регистраций — убираем их и пересчитываем счетчики
+        '''
+        DELETE FROM registrations WHERE id NOT IN (
+            SELECT MIN(id) FROM registrations GROUP BY tournament_id, user_tg_id
+        )
+        ''',
+        '''
+        UPDATE tournaments SET participants = (
+            SELECT COUNT(*) FROM registrations WHERE tournament_id = tournaments.id
+        )
+        ''',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_registrations_user
+        ON registrations (tournament_id, user_tg_id)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_registrations_date
+        ON registrations (tournament_id, registration_date)
+        ''',
+    ],
+    # 3: рассылки и их прогресс
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tournament_id TEXT,
+            text TEXT NOT NULL,
+            status TEXT DEFAULT 'running',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INTEGER,
+            user_id INTEGER,
+            status TEXT DEFAULT 'pending',
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+        ''',
+    ],
+    # 4: состояние пользователей (мастер создания турнира, регистрация) между перезапусками
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS user_state (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL
+        )
+        ''',
+    ],
+    # 5: роли пользователей по Telegram ID, первый админ — ADMIN_CHAT_ID
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS roles (
+            user_id INTEGER PRIMARY KEY,
+            role TEXT NOT NULL CHECK (role IN ('admin', 'moderator')),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        f"INSERT OR IGNORE INTO roles (user_id, role) VALUES ({int(ADMIN_CHAT_ID)}, 'admin')",
+    ],
+    # 6: разобранное время начала и очередь событий (закрытие записи, завершение, напоминания)
+    [
+        'ALTER TABLE tournaments ADD COLUMN starts_at INTEGER',
+        'CREATE INDEX IF NOT EXISTS idx_tournaments_starts_at ON tournaments (starts_at)',
+        '''
+        CREATE TABLE IF NOT EXISTS scheduled_events (
+            tournament_id TEXT,
+            kind TEXT,
+            fire_at INTEGER NOT NULL,
+            PRIMARY KEY (tournament_id, kind)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_scheduled_events_fire_at
+        ON scheduled_events (fire_at)
+        ''',
+        backfill_start_times,
+    ],
+    # 7: архив завершенных турниров и их регистраций
+    [
+        'ALTER TABLE tournaments ADD COLUMN completed_at INTEGER',
+        "UPDATE tournaments SET completed_at = CAST(strftime('%s', 'now') AS INTEGER) WHERE status = 'completed'",
+        '''
+        CREATE TABLE IF NOT EXISTS archived_tournaments (
+            archive_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT UNIQUE,
+            name TEXT NOT NULL,
+            description TEXT,
+            date TEXT,
+            entry_fee TEXT,
+            prize TEXT,
+            max_participants INTEGER,
+            participants INTEGER,
+            photo_id TEXT,
+            starts_at INTEGER,
+            completed_at INTEGER,
+            archived_at INTEGER
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS archived_registrations (
+            id INTEGER PRIMARY KEY,
+            tournament_id TEXT,
+            user_tg_id INTEGER,
+            user_tg_username TEXT,
+            nickname TEXT,
+            game_id TEXT,
+            registration_date TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_archived_registrations_tournament
+        ON archived_registrations (tournament_id, registration_date)
+        ''',
+    ],
+    # 8: счетчик id турниров, начинается после наибольшего уже выданного номера
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS id_sequence (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        ''',
+        '''
+        INSERT OR IGNORE INTO id_sequence (name, value)
+        SELECT 'tournament', COALESCE(MAX(CAST(substr(id, 12) AS INTEGER)), 0) FROM (
+            SELECT id FROM tournaments UNION ALL SELECT id FROM archived_tournaments
+        ) WHERE id LIKE 'tournament\\_%' ESCAPE '\\'
+        ''',
+    ],
+    # 9: турниры пользователя ("Мои игры") без чтения всей таблицы регистраций
+    [
+        '''
+        CREATE INDEX IF NOT EXISTS idx_registrations_by_user
+        ON registrations (user_tg_id, tournament_id)
+        ''',
+    ],
+    # 10: полнотекстовый поиск участников по нику, ID в игре и username
+    [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS registrations_fts USING fts5(
+            nickname, game_id, user_tg_username,
+            content = 'registrations', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS registrations_fts_insert AFTER INSERT ON registrations BEGIN
+            INSERT INTO registrations_fts (rowid, nickname, game_id, user_tg_username)
+            VALUES (new.id, new.nickname, new.game_id, new.user_tg_username);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS registrations_fts_delete AFTER DELETE ON registrations BEGIN
+            INSERT INTO registrations_fts (registrations_fts, rowid, nickname, game_id, user_tg_username)
+            VALUES ('delete', old.id, old.nickname, old.game_id, old.user_tg_username);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS registrations_fts_update AFTER UPDATE ON registrations BEGIN
+            INSERT INTO registrations_fts (registrations_fts, rowid, nickname, game_id, user_tg_username)
+            VALUES ('delete', old.id, old.nickname, old.game_id, old.user_tg_username);
+            INSERT INTO registrations_fts (rowid, nickname, game_id, user_tg_username)
+            VALUES (new.id, new.nickname, new.game_id, new.user_tg_username);
+        END
+        ''',
+        # Индекс для уже существующих регистраций
+        "INSERT INTO registrations_fts (registrations_fts) VALUES ('rebuild')",
+    ],
+    # 11: ссылки на матч по турнирам — у игрока в двух турнирах две разные ссылки
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS match_links (
+            tournament_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            match_link TEXT NOT NULL,
+            PRIMARY KEY (tournament_id, user_id)
+        ) WITHOUT ROWID
+        ''',
+        # Ссылки, выданные до миграции, однозначно относятся к турниру, только если игрок записан на один
+        '''
+        INSERT OR IGNORE INTO match_links (tournament_id, user_id, match_link)
+        SELECT r.tournament_id, l.user_id, l.match_link
+        FROM user_links l JOIN registrations r ON r.user_tg_id = l.user_id
+        WHERE l.match_link IS NOT NULL
+          AND (SELECT COUNT(*) FROM registrations WHERE user_tg_id = l.user_id) = 1
+        ''',
+    ],
+]
+
+# Настройки соединения, применяются при каждом подключении
+PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 67108864',
+    'PRAGMA temp_store = MEMORY',
+]
+
+class Database:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        for pragma in PRAGMAS:
+            self.conn.execute(pragma)
+        self.enable_incremental_vacuum()
+        self.migrate()
+    
+    def enable_incremental_vacuum(self):
+        """Включает auto_vacuum = INCREMENTAL, чтобы место после архивации можно было возвращать по частям"""
+        if self.conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            return
+        self.conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        # У существующей БД режим меняется только после полного VACUUM — это делается один раз
+        self.conn.execute('VACUUM')
+        print("🗄️ Включен инкрементальный VACUUM")
+    
+    def migrate(self):
+        """Применяет к БД все миграции новее её текущей версии"""
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
         
-        self.conn.commit()
+        for number, statements in enumerate(MIGRATIONS[version:], version + 1):
+            # Каждая миграция применяется целиком или не применяется вовсе
+            self.conn.execute('BEGIN')
+            try:
+                for sql in statements:
+                    if callable(sql):
+                        sql(self.conn)
+                    else:
+                        self.conn.execute(sql)
+                self.conn.execute(f'PRAGMA user_version = {number}')
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            print(f"🗄️ Схема БД обновлена до версии {number}")
     
-    def add_tournament(self, tournament_id, name, description, date, entry_fee, prize, max_participants, photo_id=None):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO tournaments (id, name, description, date, entry_fee, prize, max_participants, photo_id, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'active')
-        ''', (tournament_id, name, description, date, entry_fee, prize, max_participants, photo_id))
-        self.conn.commit()
+    def next_id(self, name):
+        """Следующее значение счетчика name; вызывать внутри транзакции"""
+        self.conn.execute('UPDATE id_sequence SET value = value + 1 WHERE name = ?', (name,))
+        return self.conn.execute('SELECT value FROM id_sequence WHERE name = ?', (name,)).fetchone()[0]
+    
+    def add_tournament(self, name, description, date, entry_fee, prize, max_participants, photo_id=None, starts_at=None):
+        """Создает турнир и возвращает его id. Номер берется из счетчика и никогда не повторяется"""
+        with self.conn:
+            tournament_id = f"tournament_{self.next_id('tournament')}"
+            self.conn.execute('''
+                INSERT INTO tournaments (id, name, description, date, entry_fee, prize, max_participants, photo_id, status, starts_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'active', ?)
+            ''', (tournament_id, name, description, date, entry_fee, prize, max_participants, photo_id, starts_at))
+            if starts_at is not None:
+                schedule_tournament(self.conn, tournament_id, starts_at)
+        return tournament_id
     
     def get_tournaments(self, active_only=True):
         cursor = self.conn.cursor()
         if active_only:
-            cursor.execute('SELECT * FROM tournaments WHERE status = "active" ORDER BY id')
+            cursor.execute('SELECT * FROM tournaments WHERE status = "active" ORDER BY starts_at IS NULL, starts_at, id')
         else:
-            cursor.execute('SELECT * FROM tournaments ORDER BY id')
+            cursor.execute('SELECT * FROM tournaments ORDER BY starts_at IS NULL, starts_at, id')
         tournaments = cursor.fetchall()
         # Конвертируем в словарь для совместимости
         result = {}
@@ -90,7 +618,8 @@ class Database:
                 'max_participants': t[6],
                 'participants': t[7],
                 'photo_id': t[8],
-                'status': t[9]
+                'status': t[9],
+                'starts_at': t[10]
             }
         return result
     
@@ -109,42 +638,63 @@ class Database:
                 'max_participants': result[6],
                 'participants': result[7],
                 'photo_id': result[8],
-                'status': result[9]
+                'status': result[9],
+                'starts_at': result[10]
             }
         return None
     
     def add_registration(self, tournament_id, user_tg_id, user_tg_username, nickname, game_id):
-        cursor = self.conn.cursor()
-        
-        # Проверяем, активен ли турнир
-        tournament = self.get_tournament(tournament_id)
-        if tournament and tournament['status'] != 'active':
-            return False, "Турнир завершен, запись невозможна"
-        
-        # Проверяем, не зарегистрирован ли уже
-        cursor.execute('''
-            SELECT * FROM registrations 
-            WHERE tournament_id = ? AND user_tg_id = ?
-        ''', (tournament_id, user_tg_id))
-        
-        if cursor.fetchone():
+        # Проверка турнира, мест и запись выполняются одной транзакцией
+        try:
+            with self.conn:
+                cursor = self.conn.execute('''
+                    INSERT INTO registrations (tournament_id, user_tg_id, user_tg_username, nickname, game_id)
+                    SELECT id, ?, ?, ?, ? FROM tournaments
+                    WHERE id = ? AND status = 'active'
+                      AND (max_participants IS NULL OR participants < max_participants)
+                ''', (user_tg_id, user_tg_username, nickname, game_id, tournament_id))
+                
+                if cursor.rowcount == 1:
+                    # Увеличиваем счетчик участников
+                    self.conn.execute('''
+                        UPDATE tournaments 
+                        SET participants = participants + 1 
+                        WHERE id = ?
+                    ''', (tournament_id,))
+                    return True, "Успешная регистрация"
+                
+                # Запись не прошла — выясняем почему. Условие на места отсекает строку раньше
+                # уникального индекса, поэтому повторную запись проверяем явно
+                if self.conn.execute(
+                    'SELECT 1 FROM registrations WHERE tournament_id = ? AND user_tg_id = ?',
+                    (tournament_id, user_tg_id)
+                ).fetchone():
+                    return False, "Ты уже зарегистрирован на этот турнир"
+                tournament = self.conn.execute(
+                    'SELECT status FROM tournaments WHERE id = ?', (tournament_id,)
+                ).fetchone()
+                if not tournament:
+                    return False, "Турнир не найден"
+                if tournament[0] == 'closed':
+                    return False, "Запись на турнир закрыта"
+                if tournament[0] != 'active':
+                    return False, "Турнир завершен, запись невозможна"
+                if not WAITLIST_ENABLED:
+                    return False, "Все места на турнир заняты"
+                
+                self.conn.execute('''
+                    INSERT OR IGNORE INTO waitlist (tournament_id, user_tg_id, user_tg_username, nickname, game_id)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (tournament_id, user_tg_id, user_tg_username, nickname, game_id))
+                position = self.conn.execute('''
+                    SELECT COUNT(*) FROM waitlist
+                    WHERE tournament_id = ? AND id <= (
+                        SELECT id FROM waitlist WHERE tournament_id = ? AND user_tg_id = ?
+                    )
+                ''', (tournament_id, tournament_id, user_tg_id)).fetchone()[0]
+                return False, f"Все места заняты, ты в листе ожидания (№{position})"
+        except sqlite3.IntegrityError:
             return False, "Ты уже зарегистрирован на этот турнир"
-        
-        # Добавляем регистрацию
-        cursor.execute('''
-            INSERT INTO registrations (tournament_id, user_tg_id, user_tg_username, nickname, game_id)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (tournament_id, user_tg_id, user_tg_username, nickname, game_id))
-        
-        # Увеличиваем счетчик участников
-        cursor.execute('''
-            UPDATE tournaments 
-            SET participants = participants + 1 
-            WHERE id = ?
-        ''', (tournament_id,))
-        
-        self.conn.commit()
-        return True, "Успешная регистрация"
     
     def get_registrations(self, tournament_id):
         cursor = self.conn.cursor()
@@ -155,6 +705,183 @@ class Database:
         ''', (tournament_id,))
         return cursor.fetchall()
     
+    def get_user_tournament_ids(self, user_tg_id):
+        """id турниров, на которые записан пользователь, в порядке записи"""
+        cursor = self.conn.execute(
+            'SELECT tournament_id FROM registrations WHERE user_tg_id = ? ORDER BY id', (user_tg_id,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+    
+    def search_registrations(self, text, tournament_id=None, limit=SEARCH_LIMIT):
+        """Ищет участников по началу ника, ID в игре или username.
+        
+        Возвращает (строки регистраций, всего найдено — но не больше SEARCH_COUNT_LIMIT).
+        """
+        match = fts_query(text)
+        if not match:
+            return [], 0
+        
+        where = 'registrations_fts MATCH ?'
+        params = [match]
+        if tournament_id:
+            where += ' AND r.tournament_id = ?'
+            params.append(tournament_id)
+        # CROSS JOIN закрепляет порядок: сначала индекс FTS, потом регистрации по rowid.
+        # Иначе планировщик может пройти все регистрации турнира, проверяя MATCH для каждой
+        query = f'FROM registrations_fts CROSS JOIN registrations r ON r.id = registrations_fts.rowid WHERE {where}'
+        
+        rows = self.conn.execute(f'SELECT r.* {query} LIMIT ?', (*params, limit)).fetchall()
+        total = len(rows)
+        if total == limit:
+            total = self.conn.execute(
+                f'SELECT COUNT(*) FROM (SELECT 1 {query} LIMIT ?)', (*params, SEARCH_COUNT_LIMIT)
+            ).fetchone()[0]
+        return rows, total
+    
+    def get_registrations_page(self, tournament_id, cursor_id=None, backward=False, limit=PARTICIPANTS_PAGE_SIZE):
+        """Страница регистраций после (или до) регистрации cursor_id, без OFFSET и полного чтения таблицы"""
+        cursor = self.conn.cursor()
+        order = 'DESC' if backward else 'ASC'
+        if cursor_id is None:
+            cursor.execute(f'''
+                SELECT * FROM registrations 
+                WHERE tournament_id = ?
+                ORDER BY registration_date {order}, id {order}
+                LIMIT ?
+            ''', (tournament_id, limit + 1))
+        else:
+            sign = '<' if backward else '>'
+            cursor.execute(f'''
+                SELECT * FROM registrations 
+                WHERE tournament_id = ?
+                  AND (registration_date, id) {sign} (SELECT registration_date, id FROM registrations WHERE id = ?)
+                ORDER BY registration_date {order}, id {order}
+                LIMIT ?
+            ''', (tournament_id, cursor_id, limit + 1))
+        rows = cursor.fetchall()
+        
+        # Лишняя строка означает, что дальше в этом направлении есть ещё записи
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+        return rows, has_more
+    
+    def iter_registrations(self, conn, tournament_id=None, batch_size=EXPORT_BATCH_SIZE):
+        """Генератор регистраций для экспорта: читает курсор пачками по batch_size строк"""
+        cursor = conn.cursor()
+        query = '''
+            SELECT r.id, r.tournament_id, t.name, r.user_tg_id, r.user_tg_username,
+                   r.nickname, r.game_id, r.registration_date
+            FROM registrations r LEFT JOIN tournaments t ON t.id = r.tournament_id
+        '''
+        if tournament_id:
+            cursor.execute(query + ' WHERE r.tournament_id = ? ORDER BY r.registration_date, r.id', (tournament_id,))
+        else:
+            cursor.execute(query + ' ORDER BY r.tournament_id, r.registration_date, r.id')
+        
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    
+    def export_registrations(self, fmt, tournament_id=None):
+        """Выгружает регистрации в CSV или JSONL во временный файл и возвращает его"""
+        output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+        # Отдельное соединение только для чтения, чтобы экспорт не занимал основное
+        conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+        try:
+            buffer = io.StringIO()
+            if fmt == 'csv':
+                writer = csv.writer(buffer)
+                writer.writerow(EXPORT_COLUMNS)
+                # BOM, чтобы Excel сразу понял кодировку
+                output.write('\ufeff'.encode('utf-8'))
+            
+            for rows in self.iter_registrations(conn, tournament_id):
+                if fmt == 'csv':
+                    writer.writerows(rows)
+                else:
+                    for row in rows:
+                        buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False))
+                        buffer.write('\n')
+                output.write(buffer.getvalue().encode('utf-8'))
+                buffer.seek(0)
+                buffer.truncate()
+            
+            output.write(buffer.getvalue().encode('utf-8'))
+        except Exception:
+            output.close()
+            raise
+        finally:
+            conn.close()
+        
+        output.seek(0)
+        return output
+    
+    def create_broadcast(self, tournament_id, text):
+        """Создает рассылку по всем участникам турнира и возвращает её id и число получателей"""
+        with self.conn:
+            cursor = self.conn.execute(
+                'INSERT INTO broadcasts (tournament_id, text) VALUES (?, ?)', (tournament_id, text)
+            )
+            broadcast_id = cursor.lastrowid
+            cursor = self.conn.execute('''
+                INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, user_id)
+                SELECT ?, user_tg_id FROM registrations WHERE tournament_id = ?
+            ''', (broadcast_id, tournament_id))
+        return broadcast_id, cursor.rowcount
+    
+    def get_broadcast_recipients(self, broadcast_id):
+        """Получатели рассылки, которым сообщение ещё не отправлено"""
+        cursor = self.conn.execute('''
+            SELECT user_id FROM broadcast_recipients
+            WHERE broadcast_id = ? AND status = 'pending'
+        ''', (broadcast_id,))
+        return [row[0] for row in cursor.fetchall()]
+    
+    def mark_broadcast_recipients(self, broadcast_id, results):
+        """Сохраняет результаты отправки пачкой: results — список (user_id, status)"""
+        with self.conn:
+            self.conn.executemany('''
+                UPDATE broadcast_recipients SET status = ?
+                WHERE broadcast_id = ? AND user_id = ?
+            ''', [(status, broadcast_id, user_id) for user_id, status in results])
+    
+    def finish_broadcast(self, broadcast_id):
+        """Отмечает рассылку завершенной и возвращает число отправленных и неудачных"""
+        with self.conn:
+            self.conn.execute("UPDATE broadcasts SET status = 'done' WHERE id = ?", (broadcast_id,))
+        cursor = self.conn.execute('''
+            SELECT
+                COALESCE(SUM(status = 'sent'), 0),
+                COALESCE(SUM(status = 'failed'), 0)
+            FROM broadcast_recipients WHERE broadcast_id = ?
+        ''', (broadcast_id,))
+        return cursor.fetchone()
+    
+    def get_unfinished_broadcasts(self):
+        cursor = self.conn.execute("SELECT id, text FROM broadcasts WHERE status = 'running' ORDER BY id")
+        return cursor.fetchall()
+    
+    def get_user_state(self, user_id):
+        cursor = self.conn.execute('SELECT data FROM user_state WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
+        return json.loads(result[0]) if result else None
+    
+    def save_user_states(self, states):
+        """Сохраняет состояния пачкой: states — список (user_id, json или None для удаления)"""
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO user_state (user_id, data) VALUES (?, ?)',
+                [(user_id, data) for user_id, data in states if data is not None]
+            )
+            self.conn.executemany(
+                'DELETE FROM user_state WHERE user_id = ?',
+                [(user_id,) for user_id, data in states if data is None]
+            )
+    
     def set_user_link(self, user_id, link):
         cursor = self.conn.cursor()
         cursor.execute('''
@@ -163,201 +890,1687 @@ class Database:
         ''', (user_id, link))
         self.conn.commit()
     
-    def get_user_link(self, user_id):
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT match_link FROM user_links WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        return result[0] if result else "https://example.com/default-match"
+    def get_user_link(self, user_id):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT match_link FROM user_links WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
+        return result[0] if result else None
+    
+    def get_match_link(self, tournament_id, user_id):
+        cursor = self.conn.execute(
+            'SELECT match_link FROM match_links WHERE tournament_id = ? AND user_id = ?', (tournament_id, user_id)
+        )
+        result = cursor.fetchone()
+        return result[0] if result else None
+    
+    def assign_match_links(self, tournament_id, rows):
+        """Сохраняет ссылки турнира пачкой одной транзакцией: rows — список (ник или user_id участника, ссылка).
+        
+        Ключ ищется среди участников турнира: сначала как ник, затем как Telegram ID,
+        поэтому числовой ник ("007") не принимается за ID. Возвращает
+        (список сохраненных (user_id, ссылка), ключи, которых нет среди участников).
+        """
+        nicknames = {}
+        user_ids = set()
+        for nickname, user_id in self.conn.execute(
+            'SELECT nickname, user_tg_id FROM registrations WHERE tournament_id = ?', (tournament_id,)
+        ):
+            nicknames[nickname] = user_id
+            user_ids.add(user_id)
+        
+        links = []
+        unknown = []
+        for key, link in rows:
+            user_id = nicknames.get(key)
+            if user_id is None and key.isdigit() and int(key) in user_ids:
+                user_id = int(key)
+            if user_id is None:
+                unknown.append(key)
+            else:
+                links.append((user_id, link))
+        
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO match_links (tournament_id, user_id, match_link) VALUES (?, ?, ?)',
+                [(tournament_id, user_id, link) for user_id, link in links]
+            )
+        return links, unknown
+    
+    def get_roles(self):
+        cursor = self.conn.execute('SELECT user_id, role FROM roles ORDER BY user_id')
+        return cursor.fetchall()
+    
+    def set_role(self, user_id, role):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO roles (user_id, role) VALUES (?, ?)', (user_id, role))
+    
+    def remove_role(self, user_id):
+        with self.conn:
+            cursor = self.conn.execute('DELETE FROM roles WHERE user_id = ?', (user_id,))
+        return cursor.rowcount > 0
+    
+    def data_version(self):
+        """Номер версии БД, меняется при коммитах других соединений (но не своих)"""
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+    
+    def delete_tournament(self, tournament_id):
+        cursor = self.conn.cursor()
+        # Сначала удаляем регистрации и лист ожидания
+        cursor.execute('DELETE FROM registrations WHERE tournament_id = ?', (tournament_id,))
+        cursor.execute('DELETE FROM waitlist WHERE tournament_id = ?', (tournament_id,))
+        cursor.execute('DELETE FROM scheduled_events WHERE tournament_id = ?', (tournament_id,))
+        cursor.execute('DELETE FROM match_links WHERE tournament_id = ?', (tournament_id,))
+        # Затем турнир
+        cursor.execute('DELETE FROM tournaments WHERE id = ?', (tournament_id,))
+        self.conn.commit()
+        return cursor.rowcount > 0
+    
+    def complete_tournament(self, tournament_id):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE tournaments 
+            SET status = 'completed', completed_at = CAST(strftime('%s', 'now') AS INTEGER)
+            WHERE id = ?
+        ''', (tournament_id,))
+        completed = cursor.rowcount > 0
+        # Завершенному турниру запланированные события уже не нужны
+        cursor.execute('DELETE FROM scheduled_events WHERE tournament_id = ?', (tournament_id,))
+        self.conn.commit()
+        return completed
+    
+    def next_event_time(self):
+        """Время ближайшего запланированного события или None"""
+        return self.conn.execute('SELECT MIN(fire_at) FROM scheduled_events').fetchone()[0]
+    
+    def run_due_events(self, now):
+        """Выполняет наступившие события: закрывает запись и завершает турниры.
+        
+        Возвращает (изменились ли турниры, напоминания к отправке [(турнир, минут до начала, время события)]).
+        """
+        changed = False
+        reminders = []
+        with self.conn:
+            rows = self.conn.execute(
+                'SELECT tournament_id, kind, fire_at FROM scheduled_events WHERE fire_at <= ? ORDER BY fire_at', (now,)
+            ).fetchall()
+            self.conn.execute('DELETE FROM scheduled_events WHERE fire_at <= ?', (now,))
+            for tournament_id, kind, fire_at in rows:
+                if kind == 'close':
+                    cursor = self.conn.execute(
+                        "UPDATE tournaments SET status = 'closed' WHERE id = ? AND status = 'active'", (tournament_id,)
+                    )
+                    changed |= cursor.rowcount > 0
+                elif kind == 'complete':
+                    cursor = self.conn.execute(
+                        "UPDATE tournaments SET status = 'completed', completed_at = ? WHERE id = ? AND status != 'completed'",
+                        (now, tournament_id)
+                    )
+                    changed |= cursor.rowcount > 0
+                elif kind.startswith('remind:'):
+                    reminders.append((tournament_id, int(kind.split(':', 1)[1]), fire_at))
+        return changed, reminders
+    
+    def archive_completed(self, completed_before, limit=ARCHIVE_BATCH_SIZE):
+        """Переносит до limit турниров, завершенных раньше completed_before, вместе с регистрациями в архив.
+        
+        Возвращает число перенесенных турниров.
+        """
+        with self.conn:
+            ids = [row[0] for row in self.conn.execute('''
+                SELECT id FROM tournaments
+                WHERE status = 'completed' AND completed_at < ?
+                ORDER BY completed_at, rowid LIMIT ?
+            ''', (completed_before, limit))]
+            if not ids:
+                return 0
+            
+            placeholders = ','.join('?' * len(ids))
+            self.conn.execute(f'''
+                INSERT OR REPLACE INTO archived_tournaments (
+                    id, name, description, date, entry_fee, prize, max_participants, participants,
+                    photo_id, starts_at, completed_at, archived_at
+                )
+                SELECT id, name, description, date, entry_fee, prize, max_participants, participants,
+                       photo_id, starts_at, completed_at, CAST(strftime('%s', 'now') AS INTEGER)
+                FROM tournaments WHERE id IN ({placeholders})
+                ORDER BY completed_at, rowid
+            ''', ids)
+            self.conn.execute(f'''
+                INSERT OR IGNORE INTO archived_registrations
+                SELECT id, tournament_id, user_tg_id, user_tg_username, nickname, game_id, registration_date
+                FROM registrations WHERE tournament_id IN ({placeholders})
+            ''', ids)
+            # Из горячих таблиц убираем всё, что относится к турнирам
+            self.conn.execute(f'''
+                DELETE FROM broadcast_recipients WHERE broadcast_id IN (
+                    SELECT id FROM broadcasts WHERE tournament_id IN ({placeholders}) AND status = 'done'
+                )
+            ''', ids)
+            self.conn.execute(f"DELETE FROM broadcasts WHERE tournament_id IN ({placeholders}) AND status = 'done'", ids)
+            for table in ('registrations', 'waitlist', 'scheduled_events', 'match_links'):
+                self.conn.execute(f'DELETE FROM {table} WHERE tournament_id IN ({placeholders})', ids)
+            self.conn.execute(f'DELETE FROM tournaments WHERE id IN ({placeholders})', ids)
+        return len(ids)
+    
+    def incremental_vacuum(self, pages=VACUUM_PAGES):
+        """Возвращает системе до pages свободных страниц файла БД"""
+        # execute() делает один шаг (одна страница), executescript выполняет прагму до конца
+        self.conn.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+    
+    def get_archive_page(self, cursor_id=None, backward=False, limit=ARCHIVE_PAGE_SIZE):
+        """Страница архива от новых к старым после (или до) записи cursor_id"""
+        order = 'ASC' if backward else 'DESC'
+        query = 'SELECT archive_id, id, name, date, participants, completed_at FROM archived_tournaments'
+        if cursor_id is None:
+            rows = self.conn.execute(f'{query} ORDER BY archive_id {order} LIMIT ?', (limit + 1,)).fetchall()
+        else:
+            sign = '>' if backward else '<'
+            rows = self.conn.execute(
+                f'{query} WHERE archive_id {sign} ? ORDER BY archive_id {order} LIMIT ?', (cursor_id, limit + 1)
+            ).fetchall()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+        return rows, has_more
+
+class AsyncDatabase:
+    """Асинхронный доступ к БД: запросы выполняются в отдельном потоке, не блокируя event loop"""
+    def __init__(self, database, max_pending=DB_MAX_PENDING):
+        self.sync = database
+        # Один поток на одно соединение: запросы выполняются строго по очереди
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+        # Ограничиваем очередь, чтобы при наплыве не копить бесконечно задач
+        self._pending = asyncio.Semaphore(max_pending)
+        
+        # Кэш каталога турниров: id -> словарь турнира (словари не изменяются, только заменяются)
+        self._catalog = None
+        self._catalog_generation = 0
+        self._catalog_lock = asyncio.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Кто хочет знать об изменениях каталога: вызываются с id турнира или None (изменилось всё)
+        self._listeners = []
+        
+        # LRU: пользователь -> кортеж id его турниров. Статусы и названия берутся из каталога,
+        # поэтому завершение турнира кэш не портит, но id удаленных и архивных турниров из него убираются
+        self._user_games = OrderedDict()
+        self.user_games_size = USER_GAMES_CACHE_SIZE
+        self.user_games_hits = 0
+        self.user_games_misses = 0
+        # LRU ссылок на матч: (турнир, пользователь) -> ссылка или None
+        self._match_links = OrderedDict()
+        self.match_links_size = MATCH_LINKS_CACHE_SIZE
+    
+    async def _run(self, func, *args, **kwargs):
+        call = partial(func, *args, **kwargs)
+        async with self._pending:
+            loop = asyncio.get_running_loop()
+            if metrics is None:
+                return await loop.run_in_executor(self._executor, call)
+            
+            started = time.perf_counter()
+            result, duration = await loop.run_in_executor(self._executor, self._timed, call)
+            metrics.observe('bot_db_query_seconds', duration, method=func.__name__)
+            # Время в очереди к потоку БД — показатель конкуренции за соединение
+            metrics.observe('bot_db_queue_wait_seconds', time.perf_counter() - started - duration)
+            return result
+    
+    @staticmethod
+    def _timed(call):
+        started = time.perf_counter()
+        result = call()
+        return result, time.perf_counter() - started
+    
+    async def _get_catalog(self):
+        if self._catalog is not None:
+            self.cache_hits += 1
+            return self._catalog
+        
+        async with self._catalog_lock:
+            if self._catalog is None:
+                self.cache_misses += 1
+                generation = self._catalog_generation
+                tournaments = await self._run(self.sync.get_tournaments, False)
+                catalog = {tid: {'id': tid, **t} for tid, t in tournaments.items()}
+                # Если во время загрузки каталог менялся, не сохраняем устаревшие данные
+                if generation != self._catalog_generation:
+                    return catalog
+                self._catalog = catalog
+            else:
+                self.cache_hits += 1
+            return self._catalog
+    
+    def subscribe(self, listener):
+        """Подписывает listener(tournament_id) на изменения каталога"""
+        self._listeners.append(listener)
+    
+    def _notify(self, tournament_id=None):
+        for listener in self._listeners:
+            listener(tournament_id)
+    
+    def invalidate_catalog(self):
+        """Сбрасывает кэш каталога турниров"""
+        self._catalog = None
+        self._catalog_generation += 1
+        self._notify()
+    
+    def cache_stats(self):
+        """Статистика попаданий в кэш каталога"""
+        return {
+            'hits': self.cache_hits, 'misses': self.cache_misses,
+            'user_games_hits': self.user_games_hits, 'user_games_misses': self.user_games_misses,
+        }
+    
+    async def add_tournament(self, *args, **kwargs):
+        try:
+            return await self._run(self.sync.add_tournament, *args, **kwargs)
+        finally:
+            self.invalidate_catalog()
+    
+    async def get_tournaments(self, active_only=True):
+        catalog = await self._get_catalog()
+        if active_only:
+            return {tid: t for tid, t in catalog.items() if t['status'] == 'active'}
+        return dict(catalog)
+    
+    async def get_tournament(self, tournament_id):
+        catalog = await self._get_catalog()
+        return catalog.get(tournament_id)
+    
+    async def add_registration(self, tournament_id, user_tg_id, *args, **kwargs):
+        success, message = await self._run(self.sync.add_registration, tournament_id, user_tg_id, *args, **kwargs)
+        if metrics is not None:
+            metrics.inc('bot_registrations_total', result='success' if success else 'rejected')
+        if success:
+            self._catalog_generation += 1
+            if self._catalog is not None and tournament_id in self._catalog:
+                tournament = self._catalog[tournament_id]
+                self._catalog[tournament_id] = {**tournament, 'participants': tournament['participants'] + 1}
+            games = self._user_games.get(user_tg_id)
+            if games is not None:
+                self._user_games[user_tg_id] = games + (tournament_id,)
+            self._notify(tournament_id)
+        return success, message
+    
+    async def get_registrations(self, tournament_id):
+        return await self._run(self.sync.get_registrations, tournament_id)
+    
+    async def get_user_tournaments(self, user_tg_id):
+        """Турниры пользователя (словари из каталога) в порядке записи"""
+        games = self._user_games.get(user_tg_id)
+        if games is None:
+            self.user_games_misses += 1
+            games = tuple(await self._run(self.sync.get_user_tournament_ids, user_tg_id))
+            self._user_games[user_tg_id] = games
+            if len(self._user_games) > self.user_games_size:
+                self._user_games.popitem(last=False)
+        else:
+            self.user_games_hits += 1
+            self._user_games.move_to_end(user_tg_id)
+        
+        catalog = await self._get_catalog()
+        return [catalog[tid] for tid in games if tid in catalog]
+    
+    def _forget_user_games(self, tournament_id):
+        """Убирает турнир из закэшированных списков пользователей"""
+        for user_tg_id, games in self._user_games.items():
+            if tournament_id in games:
+                self._user_games[user_tg_id] = tuple(tid for tid in games if tid != tournament_id)
+    
+    async def search_registrations(self, text, tournament_id=None, limit=SEARCH_LIMIT):
+        return await self._run(self.sync.search_registrations, text, tournament_id, limit)
+    
+    async def get_registrations_page(self, tournament_id, cursor_id=None, backward=False, limit=PARTICIPANTS_PAGE_SIZE):
+        return await self._run(self.sync.get_registrations_page, tournament_id, cursor_id, backward, limit)
+    
+    async def export_registrations(self, fmt, tournament_id=None):
+        # Экспорт читает через своё соединение, поэтому не стоит в общей очереди запросов
+        return await asyncio.to_thread(self.sync.export_registrations, fmt, tournament_id)
+    
+    async def create_broadcast(self, tournament_id, text):
+        return await self._run(self.sync.create_broadcast, tournament_id, text)
+    
+    async def get_broadcast_recipients(self, broadcast_id):
+        return await self._run(self.sync.get_broadcast_recipients, broadcast_id)
+    
+    async def mark_broadcast_recipients(self, broadcast_id, results):
+        return await self._run(self.sync.mark_broadcast_recipients, broadcast_id, results)
+    
+    async def finish_broadcast(self, broadcast_id):
+        return await self._run(self.sync.finish_broadcast, broadcast_id)
+    
+    async def get_unfinished_broadcasts(self):
+        return await self._run(self.sync.get_unfinished_broadcasts)
+    
+    async def get_user_state(self, user_id):
+        return await self._run(self.sync.get_user_state, user_id)
+    
+    async def save_user_states(self, states):
+        return await self._run(self.sync.save_user_states, states)
+    
+    async def set_user_link(self, user_id, link):
+        return await self._run(self.sync.set_user_link, user_id, link)
+    
+    async def get_user_link(self, user_id):
+        return await self._run(self.sync.get_user_link, user_id)
+    
+    async def get_match_link(self, tournament_id, user_id):
+        key = (tournament_id, user_id)
+        if key in self._match_links:
+            self._match_links.move_to_end(key)
+            return self._match_links[key]
+        link = await self._run(self.sync.get_match_link, tournament_id, user_id)
+        self._match_links[key] = link
+        if len(self._match_links) > self.match_links_size:
+            self._match_links.popitem(last=False)
+        return link
+    
+    async def assign_match_links(self, tournament_id, rows):
+        links, unknown = await self._run(self.sync.assign_match_links, tournament_id, rows)
+        # Обновляем только уже закэшированных, чтобы большая загрузка не вытеснила весь кэш
+        for user_id, link in links:
+            if (tournament_id, user_id) in self._match_links:
+                self._match_links[(tournament_id, user_id)] = link
+        return len(links), unknown
+    
+    async def get_roles(self):
+        return await self._run(self.sync.get_roles)
+    
+    async def set_role(self, user_id, role):
+        return await self._run(self.sync.set_role, user_id, role)
+    
+    async def remove_role(self, user_id):
+        return await self._run(self.sync.remove_role, user_id)
+    
+    async def data_version(self):
+        return await self._run(self.sync.data_version)
+    
+    async def delete_tournament(self, tournament_id):
+        try:
+            return await self._run(self.sync.delete_tournament, tournament_id)
+        finally:
+            self._forget_user_games(tournament_id)
+            self.invalidate_catalog()
+    
+    async def complete_tournament(self, tournament_id):
+        # Список турниров пользователя не меняется, новый статус придет из обновленного каталога
+        try:
+            return await self._run(self.sync.complete_tournament, tournament_id)
+        finally:
+            self.invalidate_catalog()
+    
+    async def next_event_time(self):
+        return await self._run(self.sync.next_event_time)
+    
+    async def archive_completed(self, completed_before):
+        """Архивирует завершенные турниры пачками и освобождает место в файле БД"""
+        total = 0
+        while True:
+            moved = await self._run(self.sync.archive_completed, completed_before)
+            if not moved:
+                break
+            total += moved
+            # Регистрации архивных турниров ушли из горячей таблицы
+            self._user_games.clear()
+            self.invalidate_catalog()
+        if total:
+            await self._run(self.sync.incremental_vacuum)
+        return total
+    
+    async def get_archive_page(self, cursor_id=None, backward=False, limit=ARCHIVE_PAGE_SIZE):
+        return await self._run(self.sync.get_archive_page, cursor_id, backward, limit)
+    
+    async def run_due_events(self, now):
+        changed, reminders = await self._run(self.sync.run_due_events, now)
+        if changed:
+            self.invalidate_catalog()
+        return reminders
+
+# Инициализация БД
+db = AsyncDatabase(Database())
+
+ROLE_MODERATOR = 'moderator'
+ROLE_ADMIN = 'admin'
+# Уровни ролей: старшая роль включает права младших
+ROLE_LEVELS = {ROLE_MODERATOR: 1, ROLE_ADMIN: 2}
+
+class RoleRegistry:
+    """Роли пользователей в памяти: проверка прав — одно обращение к словарю по ID.
+    
+    Изменения через бота сразу применяются к словарю; правки таблицы roles в обход бота
+    подхватываются в фоне по PRAGMA data_version.
+    """
+    def __init__(self, database, reload_interval=ROLES_RELOAD_INTERVAL):
+        self.database = database
+        self.reload_interval = reload_interval
+        # user_id -> уровень роли
+        self._levels = {}
+        self._data_version = None
+        self._task = None
+        self.load(database.sync.get_roles())
+    
+    def load(self, rows):
+        self._levels = {user_id: ROLE_LEVELS[role] for user_id, role in rows if role in ROLE_LEVELS}
+    
+    def has(self, user_id, role):
+        """Есть ли у пользователя роль role или старше"""
+        return self._levels.get(user_id, 0) >= ROLE_LEVELS[role]
+    
+    def admins(self):
+        return [user_id for user_id, level in self._levels.items() if level == ROLE_LEVELS[ROLE_ADMIN]]
+    
+    async def grant(self, user_id, role):
+        await self.database.set_role(user_id, role)
+        self._levels[user_id] = ROLE_LEVELS[role]
+    
+    async def revoke(self, user_id):
+        removed = await self.database.remove_role(user_id)
+        self._levels.pop(user_id, None)
+        return removed
+    
+    async def reload(self):
+        self.load(await self.database.get_roles())
+    
+    def start(self):
+        self._task = asyncio.create_task(self._watch())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _watch(self):
+        while True:
+            try:
+                version = await self.database.data_version()
+                if self._data_version is not None and version != self._data_version:
+                    await self.reload()
+                self._data_version = version
+            except Exception as e:
+                print(f"❌ Ошибка обновления ролей: {e}")
+            await asyncio.sleep(self.reload_interval)
+
+roles = RoleRegistry(db)
+
+class TokenBucket:
+    """Ограничитель скорости: не больше rate операций в секунду с запасом capacity"""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+    
+    def pause(self, seconds):
+        """Останавливает выдачу токенов, например после RetryAfter от Telegram"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+    
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class AdminNotifier:
+    """Очередь уведомлений админам: отправляет их сводками в фоне, не задерживая пользователей.
+    
+    Получатели — все текущие админы из recipients (по умолчанию roles.admins).
+    """
+    def __init__(self, recipients=None, window=ADMIN_DIGEST_WINDOW, batch_size=ADMIN_DIGEST_SIZE):
+        self.recipients = recipients or roles.admins
+        self.window = window
+        self.batch_size = batch_size
+        self._pending = deque()
+        # Отправляемая сводка: [число уведомлений, текст, кому еще не отправлена]
+        self._sending = None
+        self._wakeup = None
+        self._task = None
+    
+    def notify(self, text):
+        """Ставит уведомление в очередь, не дожидаясь отправки"""
+        self._pending.append(text)
+        if len(self._pending) >= self.batch_size and self._wakeup:
+            self._wakeup.set()
+    
+    def start(self, bot):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._loop(bot))
+    
+    async def stop(self, bot):
+        """Останавливает фоновую отправку и досылает накопленное"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush(bot)
+    
+    async def _loop(self, bot):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.window)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush(bot)
+    
+    def _digest(self):
+        """Собирает сводку из первых уведомлений очереди, укладываясь в лимит сообщения"""
+        items = []
+        length = 0
+        for text in self._pending:
+            if items and (len(items) >= self.batch_size or length + len(text) + 2 > MESSAGE_LIMIT):
+                break
+            items.append(text)
+            length += len(text) + 2
+        return items
+    
+    async def flush(self, bot):
+        while self._pending:
+            if self._sending is None:
+                items = self._digest()
+                self._sending = [len(items), "\n\n".join(items)[:MESSAGE_LIMIT], list(self.recipients())]
+            count, text, chat_ids = self._sending
+            while chat_ids:
+                try:
+                    await bot.send_message(chat_id=chat_ids[0], text=text)
+                except RetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                    continue
+                except (Forbidden, BadRequest) as e:
+                    # Админ заблокировал бота или не начинал с ним диалог — остальным отправляем
+                    print(f"❌ ОШИБКА ОТПРАВКИ АДМИНУ {chat_ids[0]}: {e}")
+                except TelegramError as e:
+                    # Сводка остается в очереди и уйдет оставшимся админам в следующий раз
+                    print(f"❌ ОШИБКА ОТПРАВКИ АДМИНУ: {e}")
+                    return
+                chat_ids.pop(0)
+            # Удаляем только после отправки всем админам
+            for _ in range(count):
+                self._pending.popleft()
+            self._sending = None
+            print(f"✅ УВЕДОМЛЕНИЕ ОТПРАВЛЕНО АДМИНАМ! ({count} шт.)")
+
+admin_notifier = AdminNotifier()
+
+class Broadcaster:
+    """Рассылка участникам турнира с ограничением скорости и сохранением прогресса в БД.
+    
+    Вместо настоящего бота можно передать любой объект с асинхронным send_message.
+    """
+    def __init__(self, database, rate=BROADCAST_RATE, workers=BROADCAST_WORKERS):
+        self.db = database
+        self.rate = rate
+        self.workers = workers
+        self._limiter = None
+        # Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+        self._tasks = set()
+        self._running = set()
+    
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def start(self, bot, tournament_id, text):
+        """Создает рассылку и запускает её в фоне. Возвращает число получателей"""
+        broadcast_id, recipients = await self.db.create_broadcast(tournament_id, text)
+        self._spawn(self.run(bot, broadcast_id, text))
+        return recipients
+    
+    async def resume(self, bot):
+        """Продолжает рассылки, прерванные перезапуском"""
+        for broadcast_id, text in await self.db.get_unfinished_broadcasts():
+            if broadcast_id in self._running:
+                continue
+            print(f"📢 Продолжаем рассылку #{broadcast_id}")
+            self._spawn(self.run(bot, broadcast_id, text))
+    
+    async def run(self, bot, broadcast_id, text):
+        if self._limiter is None:
+            # Один ограничитель на все рассылки: лимит Telegram общий для бота
+            self._limiter = TokenBucket(self.rate)
+        
+        self._running.add(broadcast_id)
+        try:
+            await self._run_broadcast(bot, broadcast_id, text)
+        finally:
+            self._running.discard(broadcast_id)
+    
+    async def _run_broadcast(self, bot, broadcast_id, text):
+        queue = asyncio.Queue()
+        for user_id in await self.db.get_broadcast_recipients(broadcast_id):
+            queue.put_nowait(user_id)
+        
+        results = []
+        
+        async def flush():
+            if results:
+                batch = results[:]
+                results.clear()
+                await self.db.mark_broadcast_recipients(broadcast_id, batch)
+        
+        async def worker():
+            while not queue.empty():
+                user_id = queue.get_nowait()
+                results.append((user_id, await self._send(bot, user_id, text)))
+                if len(results) >= BROADCAST_FLUSH_EVERY:
+                    await flush()
+        
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.workers)))
+        finally:
+            await flush()
+        
+        sent, failed = await self.db.finish_broadcast(broadcast_id)
+        print(f"📢 Рассылка #{broadcast_id} завершена: отправлено {sent}, ошибок {failed}")
+        admin_notifier.notify(f"📢 Рассылка завершена\n✅ Отправлено: {sent}\n❌ Не доставлено: {failed}")
+    
+    async def _send(self, bot, user_id, text):
+        for attempt in range(BROADCAST_MAX_ATTEMPTS):
+            await self._limiter.acquire()
+            try:
+                await bot.send_message(chat_id=user_id, text=text)
+                return 'sent'
+            except RetryAfter as e:
+                # Флуд-контроль касается всего бота — притормаживаем все отправки
+                self._limiter.pause(e.retry_after)
+            except (Forbidden, BadRequest):
+                # Пользователь заблокировал бота или чат не найден — повторять бессмысленно
+                return 'failed'
+            except NetworkError:
+                await asyncio.sleep(2 ** attempt)
+            except TelegramError as e:
+                # Любая другая ошибка API касается одного получателя и не должна обрывать рассылку
+                print(f"❌ Рассылка: не удалось отправить {user_id}: {e}")
+                return 'failed'
+        return 'failed'
+
+broadcaster = Broadcaster(db)
+
+def format_offset(minutes):
+    """'1 д', '2 ч', '30 мин' — для текста напоминания"""
+    if minutes % 1440 == 0:
+        return f"{minutes // 1440} д"
+    if minutes % 60 == 0:
+        return f"{minutes // 60} ч"
+    return f"{minutes} мин"
+
+class TournamentScheduler:
+    """Жизненный цикл турниров по расписанию: закрытие записи, завершение и напоминания.
+    
+    События хранятся в таблице scheduled_events с индексом по времени. В job queue всегда стоит
+    одна задача — на ближайшее событие; сработав, она выполняет все наступившие события и
+    ставит следующую. Сколько бы событий ни ждало, между срабатываниями они ничего не стоят,
+    а после перезапуска очередь восстанавливается из БД (просроченное выполняется сразу).
+    """
+    def __init__(self, database, broadcaster):
+        self.db = database
+        self.broadcaster = broadcaster
+        self.job_queue = None
+        self._job = None
+        self._next_at = None
+        self._lock = asyncio.Lock()
+    
+    async def start(self, application):
+        self.job_queue = application.job_queue
+        if self.job_queue is None:
+            print("⚠️ Job queue недоступна (нужен python-telegram-bot[job-queue]), расписание турниров отключено")
+            return
+        await self.reschedule()
+    
+    async def reschedule(self):
+        """Ставит задачу на ближайшее событие; вызывается после добавления турнира"""
+        if self.job_queue is None:
+            return
+        async with self._lock:
+            next_at = await self.db.next_event_time()
+            if self._job is not None and next_at == self._next_at:
+                return
+            if self._job is not None:
+                self._job.schedule_removal()
+                self._job = None
+            self._next_at = next_at
+            if next_at is not None:
+                self._job = self.job_queue.run_once(
+                    self._fire, when=max(0, next_at - time.time()), name='tournament_events'
+                )
+    
+    async def _fire(self, context):
+        self._job = None
+        self._next_at = None
+        now = int(time.time())
+        try:
+            for tournament_id, minutes, fire_at in await self.db.run_due_events(now):
+                await self._remind(context.bot, tournament_id, minutes, now - fire_at)
+        except Exception as e:
+            print(f"❌ Ошибка обработки событий турниров: {e}")
+        await self.reschedule()
+    
+    async def _remind(self, bot, tournament_id, minutes, late):
+        tournament = await self.db.get_tournament(tournament_id)
+        if tournament is None or tournament['status'] != 'active':
+            return
+        if late > REMINDER_GRACE:
+            print(f"⏰ Пропущено опоздавшее напоминание турнира {tournament_id}")
+            return
+        await self.broadcaster.start(
+            bot, tournament_id,
+            f"⏰ Турнир «{tournament['name']}» начнется через {format_offset(minutes)}\n📅 {tournament['date']}"
+        )
+
+scheduler = TournamentScheduler(db, broadcaster)
+
+class SQLitePersistence(BasePersistence):
+    """Хранит user_data в SQLite, чтобы перезапуск не обрывал начатые сценарии.
+    
+    Состояние пользователя загружается при его первом обновлении после запуска,
+    изменения копятся и записываются в БД одной пачкой раз в PERSISTENCE_INTERVAL секунд.
+    """
+    def __init__(self, database, update_interval=PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.db = database
+        self._loaded = set()
+        self._dirty = {}
+        self._write_task = None
+    
+    async def get_user_data(self):
+        # Ничего не грузим заранее — см. refresh_user_data
+        return {}
+    
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded:
+            return
+        self._loaded.add(user_id)
+        state = await self.db.get_user_state(user_id)
+        if state:
+            user_data.update(state)
+    
+    async def update_user_data(self, user_id, data):
+        self._dirty[user_id] = json.dumps(data, ensure_ascii=False) if data else None
+        # Все изменения одного цикла сохранения уходят в БД одной транзакцией
+        if self._write_task is None:
+            self._write_task = asyncio.create_task(self._write())
+    
+    async def drop_user_data(self, user_id):
+        await self.update_user_data(user_id, None)
+    
+    async def _save(self):
+        """Записывает накопленные изменения; при ошибке возвращает их в очередь"""
+        states, self._dirty = self._dirty, {}
+        try:
+            await self.db.save_user_states(list(states.items()))
+        except Exception:
+            # Изменения, пришедшие во время записи, новее — они остаются поверх
+            states.update(self._dirty)
+            self._dirty = states
+            raise
+    
+    async def _write(self):
+        # Задача живет, пока запись не закончена: flush дожидается именно ее.
+        # Изменения, пришедшие во время записи, уходят следующей пачкой той же задачей
+        try:
+            await asyncio.sleep(0)
+            while self._dirty:
+                await self._save()
+        except Exception as e:
+            print(f"❌ Ошибка сохранения состояний пользователей: {e}")
+        finally:
+            self._write_task = None
+    
+    async def flush(self):
+        if self._write_task is not None:
+            await self._write_task
+        if self._dirty:
+            await self._save()
+    
+    async def get_chat_data(self):
+        return {}
+    
+    async def get_bot_data(self):
+        return {}
+    
+    async def get_callback_data(self):
+        return None
+    
+    async def get_conversations(self, name):
+        return {}
+    
+    async def update_conversation(self, name, key, new_state):
+        pass
+    
+    async def update_chat_data(self, chat_id, data):
+        pass
+    
+    async def update_bot_data(self, data):
+        pass
+    
+    async def update_callback_data(self, data):
+        pass
+    
+    async def drop_chat_data(self, chat_id):
+        pass
+    
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+    
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+def is_admin(user):
+    """Проверяет, является ли пользователь админом"""
+    return user is not None and roles.has(user.id, ROLE_ADMIN)
+
+def is_staff(user):
+    """Админ или модератор: видит админ панель"""
+    return user is not None and roles.has(user.id, ROLE_MODERATOR)
+
+# Лимит Telegram на callback_data в байтах
+CALLBACK_DATA_LIMIT = 64
+# Версия формата callback_data: кнопки живут в отправленных сообщениях, поэтому при смене
+# аргументов маршрута версия повышается, а старые версии разбираются отдельно
+CALLBACK_VERSION = "1"
+
+def cb(route, *args):
+    """Собирает callback_data в формате "<версия>|<маршрут>:<арг1>:<арг2>..." """
+    data = CALLBACK_VERSION + "|" + ":".join([route, *map(str, args)])
+    if len(data.encode()) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f"callback_data длиннее {CALLBACK_DATA_LIMIT} байт: {data}")
+    return data
+
+class CallbackRouter:
+    """Таблица маршрутов для инлайн кнопок.
+    
+    Данные кнопки имеют вид "<версия>|<маршрут>:<арг1>:<арг2>...", обработчик ищется одним обращением
+    к словарю. Кнопки из уже отправленных сообщений тоже разбираются: без версии ("t:tournament_1")
+    и старого формата ("register_tournament_1" и т.п.) — по таблице префиксов. Кнопки неизвестной
+    версии не обрабатываются.
+    """
+    def __init__(self):
+        self._routes = {}
+        self._legacy = []
+    
+    def route(self, name, role=None):
+        """Декоратор: регистрирует обработчик маршрута, role — минимальная роль для доступа"""
+        def decorator(func):
+            if name in self._routes:
+                raise ValueError(f"Маршрут {name} уже зарегистрирован")
+            if role is not None and role not in ROLE_LEVELS:
+                raise ValueError(f"Неизвестная роль {role}")
+            self._routes[name] = (func, role)
+            return func
+        return decorator
     
-    def delete_tournament(self, tournament_id):
-        cursor = self.conn.cursor()
-        # Сначала удаляем регистрации
-        cursor.execute('DELETE FROM registrations WHERE tournament_id = ?', (tournament_id,))
-        # Затем турнир
-        cursor.execute('DELETE FROM tournaments WHERE id = ?', (tournament_id,))
-        self.conn.commit()
-        return cursor.rowcount > 0
+    def legacy(self, prefix, name, parse=None):
+        """Добавляет перевод старого формата: prefix<аргумент> -> name:<аргумент>"""
+        self._legacy.append((prefix, name, parse or (lambda data: [data[len(prefix):]])))
+        # Более длинные префиксы проверяются первыми
+        self._legacy.sort(key=lambda item: len(item[0]), reverse=True)
     
-    def complete_tournament(self, tournament_id):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE tournaments 
-            SET status = 'completed' 
-            WHERE id = ?
-        ''', (tournament_id,))
-        self.conn.commit()
-        return cursor.rowcount > 0
+    def parse(self, data):
+        """Разбирает callback_data в (маршрут, аргументы)"""
+        version, versioned, payload = data.partition("|")
+        if versioned:
+            if version != CALLBACK_VERSION:
+                return None, []
+            data = payload
+        name, _, args = data.partition(":")
+        if name in self._routes:
+            return name, args.split(":") if args else []
+        
+        for prefix, legacy_name, parse in self._legacy:
+            if data.startswith(prefix):
+                return legacy_name, parse(data)
+        return None, []
+    
+    async def dispatch(self, query, context):
+        name, args = self.parse(query.data or "")
+        route = self._routes.get(name)
+        if route is None:
+            await query.answer()
+            return
+        
+        handler, role = route
+        if role is not None and not roles.has(query.from_user.id, role):
+            await query.answer("⛔ Недостаточно прав", show_alert=True)
+            return
+        
+        await query.answer()
+        started = time.perf_counter()
+        try:
+            await handler(query, context, *args)
+        finally:
+            views.release(query)
+            if metrics is not None:
+                metrics.observe('bot_callback_route_seconds', time.perf_counter() - started, route=name)
 
-# Инициализация БД
-db = Database()
+router = CallbackRouter()
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /start"""
-    user = update.effective_user
-    is_admin = user.username and user.username.lower() == ADMIN_USERNAME.lower()
-    
+# Старый формат кнопок, которые ещё могут оставаться в отправленных сообщениях
+router.legacy("tournament_", "t", lambda data: [data])
+router.legacy("admin_tournament_", "at")
+router.legacy("register_", "reg")
+router.legacy("delete_", "del")
+router.legacy("complete_", "done")
+router.legacy("broadcast_", "bc")
+router.legacy("participants_", "pl")
+router.legacy("participants_page_", "pl", lambda data: data[len("participants_page_"):].rsplit("_", 3))
+router.legacy("export_", "exp", lambda data: data[len("export_"):].split("_", 1))
+
+# Статичные тексты и клавиатуры строятся один раз при запуске
+WELCOME_TEXT = (
+    "Привет, ты попал в Ringing Tournament 📡\n"
+    "Воспользуйся кнопками ниже чтобы ознакомиться с интерфейсом бота."
+)
+
+def _start_markup(admin):
     keyboard = [
-        [InlineKeyboardButton("Меню", callback_data="menu")],
+        [InlineKeyboardButton("Меню", callback_data=cb("menu"))],
         [InlineKeyboardButton("Связь с менеджером", url=f"https://t.me/{ADMIN_USERNAME}")],
         [InlineKeyboardButton("Наш телеграм канал", url="https://t.me/RingingTournament")],
-        [InlineKeyboardButton("Уведомления", callback_data="notifications")]
+        [InlineKeyboardButton("Уведомления", callback_data=cb("notifications"))]
     ]
+    if admin:
+        keyboard.insert(1, [InlineKeyboardButton("Админ панель", callback_data=cb("admin_panel"))])
+    return InlineKeyboardMarkup(keyboard)
+
+def _back_markup(route):
+    return InlineKeyboardMarkup([[InlineKeyboardButton("Назад", callback_data=cb(route))]])
+
+START_MARKUP = _start_markup(admin=False)
+START_MARKUP_ADMIN = _start_markup(admin=True)
+MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Турниры", callback_data=cb("tournaments"))],
+    [InlineKeyboardButton("Мои игры", callback_data=cb("my_games"))],
+    [InlineKeyboardButton("Назад", callback_data=cb("back_to_start"))]
+])
+ADMIN_PANEL_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Добавить турнир", callback_data=cb("add_tournament"))],
+    [InlineKeyboardButton("Просмотреть турниры", callback_data=cb("view_tournaments"))],
+    [InlineKeyboardButton("🗄 Архив турниров", callback_data=cb("arch"))],
+    [InlineKeyboardButton("📨 Отправить сообщение", callback_data=cb("send_message"))],
+    [InlineKeyboardButton("📤 Экспорт всех записей (CSV)", callback_data=cb("exp", "csv", "all"))],
+    [InlineKeyboardButton("Назад", callback_data=cb("menu"))]
+])
+BACK_TO_MENU_MARKUP = _back_markup("menu")
+BACK_TO_MY_GAMES_MARKUP = _back_markup("my_games")
+BACK_TO_ADMIN_PANEL_MARKUP = _back_markup("admin_panel")
+BACK_TO_ADMIN_TOURNAMENTS_MARKUP = _back_markup("view_tournaments")
+
+# Значок и название статуса турнира
+STATUS_LABELS = {
+    'active': ('✅', 'Активный'),
+    'closed': ('⏳', 'Запись закрыта'),
+    'completed': ('🏁', 'Завершен'),
+}
+
+class CardCache:
+    """Готовые карточки и списки турниров.
+    
+    Карточка строится один раз и сбрасывается, когда турнир меняется (в том числе число участников),
+    списки — когда меняется каталог.
+    """
+    def __init__(self, database):
+        self.db = database
+        self._cards = {}
+        self._lists = {}
+        database.subscribe(self.invalidate)
     
-    if is_admin:
-        keyboard.insert(1, [InlineKeyboardButton("Админ панель", callback_data="admin_panel")])
+    def invalidate(self, tournament_id=None):
+        if tournament_id is None:
+            self._cards.clear()
+            self._lists.clear()
+        else:
+            self._cards.pop(tournament_id, None)
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    def card(self, tournament):
+        """Текст карточки и клавиатуры для разных экранов"""
+        card = self._cards.get(tournament['id'])
+        if card is None:
+            card = self._cards[tournament['id']] = self._build_card(tournament)
+        return card
     
-    welcome_text = (
-        "Привет, ты попал в Ringing Tournament 📡\n"
-        "Воспользуйся кнопками ниже чтобы ознакомиться с интерфейсом бота."
-    )
+    @staticmethod
+    def _build_card(tournament):
+        tournament_id = tournament['id']
+        active = tournament['status'] == 'active'
+        icon, label = STATUS_LABELS.get(tournament['status'], STATUS_LABELS['completed'])
+        text = (
+            f"🏆 {tournament['name']} {icon}\n\n"
+            f"📝 {tournament['description']}\n"
+            f"📅 Дата: {tournament['date']}\n"
+            f"💰 Призовой фонд: {tournament['prize']}\n"
+            f"💵 Стоимость участия: {tournament['entry_fee']}\n"
+            f"👥 Участников: {tournament['participants']}/{tournament['max_participants']}\n"
+            f"📊 Статус: {label}"
+        )
+        
+        user_keyboard = []
+        if active:
+            user_keyboard.append([InlineKeyboardButton("📝 Записаться", callback_data=cb("reg", tournament_id))])
+        user_keyboard.append([InlineKeyboardButton("Назад", callback_data=cb("tournaments"))])
+        
+        admin_keyboard = []
+        if tournament['status'] != 'completed':
+            admin_keyboard.append([InlineKeyboardButton("🏁 Завершить турнир", callback_data=cb("done", tournament_id))])
+        admin_keyboard.append([InlineKeyboardButton("❌ Удалить турнир", callback_data=cb("del", tournament_id))])
+        admin_keyboard.append([InlineKeyboardButton("📋 Список участников", callback_data=cb("pl", tournament_id))])
+        admin_keyboard.append([InlineKeyboardButton("🔍 Поиск участника", callback_data=cb("find", tournament_id))])
+        admin_keyboard.append([InlineKeyboardButton("📢 Рассылка участникам", callback_data=cb("bc", tournament_id))])
+        admin_keyboard.append([InlineKeyboardButton("🔗 Загрузить ссылки на матч", callback_data=cb("links", tournament_id))])
+        admin_keyboard.append([
+            InlineKeyboardButton("📤 CSV", callback_data=cb("exp", "csv", tournament_id)),
+            InlineKeyboardButton("📤 JSONL", callback_data=cb("exp", "jsonl", tournament_id))
+        ])
+        admin_keyboard.append([InlineKeyboardButton("Назад", callback_data=cb("view_tournaments"))])
+        
+        return {
+            'text': text,
+            'markup': InlineKeyboardMarkup(user_keyboard),
+            'my_games_markup': InlineKeyboardMarkup([
+                [InlineKeyboardButton("🔗 Ссылка на матч", callback_data=cb("link", tournament_id))],
+                [InlineKeyboardButton("Назад", callback_data=cb("my_games"))],
+            ]) if tournament['status'] != 'completed' else BACK_TO_MY_GAMES_MARKUP,
+            'admin_markup': InlineKeyboardMarkup(admin_keyboard),
+            # Обложка — file_id, полученный при создании турнира: фото не загружается повторно
+            'photo': tournament['photo_id'] if len(text) <= CAPTION_LIMIT else None,
+        }
+    
+    async def tournament_list(self):
+        """Клавиатура со списком активных турниров или None, если их нет"""
+        if 'user' not in self._lists:
+            tournaments = await self.db.get_tournaments()
+            markup = None
+            if tournaments:
+                keyboard = [
+                    [InlineKeyboardButton(f"{t['name']} {STATUS_LABELS[t['status']][0]}", callback_data=cb("t", tid))]
+                    for tid, t in tournaments.items()
+                ]
+                keyboard.append([InlineKeyboardButton("Назад", callback_data=cb("menu"))])
+                markup = InlineKeyboardMarkup(keyboard)
+            self._lists['user'] = markup
+        return self._lists['user']
     
-    await update.message.reply_text(welcome_text, reply_markup=reply_markup)
+    async def admin_list(self):
+        """Текст и клавиатура списка всех турниров для админа"""
+        if 'admin' not in self._lists:
+            tournaments = await self.db.get_tournaments(active_only=False)
+            if not tournaments:
+                self._lists['admin'] = ("❌ Нет созданных турниров", BACK_TO_ADMIN_PANEL_MARKUP)
+            else:
+                lines = ["🏆 Все турниры:\n"]
+                keyboard = []
+                for tournament_id, tournament in tournaments.items():
+                    status_text = " ".join(STATUS_LABELS.get(tournament['status'], STATUS_LABELS['completed']))
+                    lines.append(f"• {tournament['name']} ({status_text})")
+                    keyboard.append([InlineKeyboardButton(f"📋 {tournament['name']}", callback_data=cb("at", tournament_id))])
+                keyboard.append([InlineKeyboardButton("Назад", callback_data=cb("admin_panel"))])
+                self._lists['admin'] = ("\n".join(lines) + "\n", InlineKeyboardMarkup(keyboard))
+        return self._lists['admin']
 
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик нажатий на инлайн кнопки"""
-    query = update.callback_query
-    await query.answer()
+cards = CardCache(db)
+
+class InlineSearch:
+    """Поиск активных турниров для inline режима (@бот запрос) без обращений к SQLite.
     
-    user = query.from_user
-    is_admin = user.username and user.username.lower() == ADMIN_USERNAME.lower()
+    Индекс — отсортированный список (слово названия, id турнира): турниры, у которых есть слово
+    с данным началом, находятся двоичным поиском. Найденные id запоминаются по тексту запроса,
+    готовые результаты — по турниру. Индекс и ответы сбрасываются при изменении каталога,
+    результат турнира — при изменении самого турнира (например, числа участников).
+    """
+    def __init__(self, database, cards):
+        self.db = database
+        self.cards = cards
+        self._index = None
+        self._order = {}
+        self._generation = 0
+        self._memo = OrderedDict()
+        self._results = {}
+        database.subscribe(self.invalidate)
     
-    data = query.data
+    def invalidate(self, tournament_id=None):
+        if tournament_id is None:
+            self._index = None
+            self._generation += 1
+            self._memo.clear()
+            self._results.clear()
+        else:
+            self._results.pop(tournament_id, None)
+    
+    async def _build_index(self):
+        tournaments = await self.db.get_tournaments()
+        order = {tid: position for position, tid in enumerate(tournaments)}
+        index = sorted(
+            (word, tid) for tid, t in tournaments.items() for word in set(t['name'].lower().split())
+        )
+        return index, order
     
-    if data == "menu":
-        await query.delete_message()
-        await show_menu(query, context)
+    @staticmethod
+    def _prefix(index, prefix):
+        """id турниров, у которых есть слово, начинающееся с prefix"""
+        found = set()
+        position = bisect_left(index, (prefix,))
+        while position < len(index) and index[position][0].startswith(prefix):
+            found.add(index[position][1])
+            position += 1
+        return found
     
-    elif data == "admin_panel" and is_admin:
-        await show_admin_panel(query, context)
+    async def search(self, text):
+        """id подходящих турниров в порядке каталога: каждое слово запроса — начало слова названия"""
+        key = ' '.join(text.lower().split())
+        if key in self._memo:
+            self._memo.move_to_end(key)
+            return self._memo[key]
+        
+        generation = self._generation
+        index, order = self._index, self._order
+        if index is None:
+            index, order = await self._build_index()
+        if key:
+            matches = set.intersection(*(self._prefix(index, word) for word in key.split()))
+        else:
+            matches = order.keys()
+        found = tuple(sorted(matches, key=order.get)[:INLINE_RESULTS_LIMIT])
+        
+        # Если каталог поменялся, пока строился индекс, результат не запоминаем
+        if generation != self._generation:
+            return found
+        self._index, self._order = index, order
+        self._memo[key] = found
+        if len(self._memo) > INLINE_MEMO_SIZE:
+            self._memo.popitem(last=False)
+        return found
     
-    elif data == "notifications":
-        await query.edit_message_text("🔔 Настройки уведомлений будут здесь")
+    async def results(self, text, bot_username):
+        """Карточки найденных турниров с кнопкой записи через бота"""
+        results = []
+        for tournament_id in await self.search(text):
+            result = self._results.get(tournament_id)
+            if result is None:
+                tournament = await self.db.get_tournament(tournament_id)
+                if tournament is None:
+                    continue
+                result = self._results[tournament_id] = self._build_result(tournament, bot_username)
+            results.append(result)
+        return results
     
-    elif data == "back_to_menu":
-        await show_menu(query, context)
+    def _build_result(self, tournament, bot_username):
+        card = self.cards.card(tournament)
+        description = f"📅 {tournament['date']} · 👥 {tournament['participants']}/{tournament['max_participants']}"
+        # Callback-кнопки в сообщениях через inline приходят без чата, поэтому запись — по ссылке в бота
+        reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton(
+            "📝 Записаться", url=f"https://t.me/{bot_username}?start=reg_{tournament['id']}"
+        )]])
+        if card['photo']:
+            return InlineQueryResultCachedPhoto(
+                id=tournament['id'], photo_file_id=card['photo'], title=tournament['name'],
+                description=description, caption=card['text'], reply_markup=reply_markup,
+            )
+        return InlineQueryResultArticle(
+            id=tournament['id'],
+            title=tournament['name'],
+            description=description,
+            input_message_content=InputTextMessageContent(card['text']),
+            reply_markup=reply_markup,
+        )
+
+inline_search = InlineSearch(db, cards)
+
+class ViewCache:
+    """Последнее содержимое сообщений бота: (chat_id, message_id) -> (хэш текста, клавиатуры и фото, file_id фото).
     
-    elif data == "tournaments":
-        await show_tournaments(query, context)
+    По file_id видно, фото-сообщение это или текстовое, без запросов к Telegram.
+    Старые записи вытесняются (LRU), когда их больше max_size.
+    """
+    def __init__(self, max_size=VIEW_CACHE_SIZE):
+        self.max_size = max_size
+        self._views = OrderedDict()
+        # Сообщения, замененные новыми в текущем обработчике: id(нажатия) -> новое сообщение
+        self._moved = {}
+        self.skipped = 0
     
-    elif data == "my_games":
-        await show_my_games(query, context)
+    @staticmethod
+    def key(query):
+        message = query.message
+        if message is None:
+            return query.inline_message_id
+        return message.chat_id, message.message_id
     
-    elif data == "back_to_games":
-        await show_my_games(query, context)
+    @staticmethod
+    def fingerprint(text, reply_markup, photo=None):
+        return hash((text, reply_markup, photo))
     
-    elif data == "tournament_info":
-        tournaments = db.get_tournaments()
-        if tournaments:
-            first_tournament_id = list(tournaments.keys())[0]
-            await show_tournament_details(query, context, first_tournament_id, from_my_games=True)
-        else:
-            keyboard = [[InlineKeyboardButton("Назад", callback_data="my_games")]]
-            await query.edit_message_text(
-                "ℹ️ Нет активных турниров", 
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
+    def get(self, key):
+        """(отпечаток, file_id фото или None) или None, если сообщение не в кэше"""
+        view = self._views.get(key)
+        if view is not None:
+            self._views.move_to_end(key)
+        return view
     
-    elif data.startswith("tournament_"):
-        tournament_id = data
-        await show_tournament_details(query, context, tournament_id)
+    def put(self, key, fingerprint, photo=None):
+        self._views[key] = (fingerprint, photo)
+        self._views.move_to_end(key)
+        if len(self._views) > self.max_size:
+            self._views.popitem(last=False)
     
-    elif data.startswith("admin_tournament_"):
-        tournament_id = data.replace("admin_tournament_", "")
-        await show_admin_tournament_details(query, context, tournament_id)
+    def forget(self, key):
+        self._views.pop(key, None)
     
-    elif data.startswith("register_"):
-        tournament_id = data.replace("register_", "")
-        await start_registration(query, context, tournament_id)
+    def moved(self, query):
+        return self._moved.get(id(query))
     
-    elif data == "add_tournament":
-        await query.edit_message_text("Введите название турнира:")
-        context.user_data['waiting_for_tournament_name'] = True
+    def move(self, query, message):
+        """Запоминает, что сообщение нажатия заменено на message: следующие правки этого обработчика пойдут в него"""
+        self._moved[id(query)] = message
     
-    elif data == "view_tournaments":
-        await show_admin_tournaments(query, context)
+    def release(self, query):
+        """Забывает замену после обработки нажатия: к старому сообщению она больше не относится"""
+        self._moved.pop(id(query), None)
+
+views = ViewCache()
+
+def _message_view(message):
+    """Отпечаток и file_id фото сообщения, которое бот ещё не правил"""
+    if message.photo:
+        photo = message.photo[-1].file_id
+        return views.fingerprint(message.caption, message.reply_markup, photo), photo
+    return views.fingerprint(message.text, message.reply_markup), None
+
+async def edit_view(query, text, reply_markup=None, photo=None):
+    """Показывает экран в сообщении с кнопкой, если новое содержимое отличается от текущего.
     
-    elif data == "send_message":
-        await query.edit_message_text("Введите ID пользователя и сообщение в формате: user_id текст сообщения")
-        context.user_data['waiting_for_user_message'] = True
+    photo — file_id обложки. Фото меняется через edit_media, подпись — через edit_caption.
+    Добавить фото к текстовому сообщению или убрать его Telegram не позволяет,
+    поэтому тогда сообщение заменяется новым.
+    """
+    message = query.message
+    key = views.key(query)
+    moved = views.moved(query)
+    if moved is not None:
+        # Это сообщение уже заменено новым (например, после удаления турнира с обложкой)
+        message = moved
+        key = (message.chat_id, message.message_id)
+    if message is None:
+        # Сообщения, отправленные через inline режим, правим только текстом
+        photo = None
     
-    elif data.startswith("delete_"):
-        tournament_id = data.replace("delete_", "")
-        if db.delete_tournament(tournament_id):
-            await query.edit_message_text("✅ Турнир удален!")
-        else:
-            await query.edit_message_text("❌ Турнир не найден")
-        await show_admin_tournaments(query, context)
+    fingerprint = views.fingerprint(text, reply_markup, photo)
+    view = views.get(key)
+    if view is None and message is not None:
+        view = _message_view(message)
+    current, current_photo = view or (None, None)
+    if current == fingerprint:
+        views.skipped += 1
+        return
     
-    elif data.startswith("complete_"):
-        tournament_id = data.replace("complete_", "")
-        if db.complete_tournament(tournament_id):
-            await query.edit_message_text("✅ Турнир завершен!")
+    try:
+        if message is None:
+            await query.edit_message_text(text, reply_markup=reply_markup)
+        elif (photo is None) != (current_photo is None):
+            await replace_view(query, message, key, text, reply_markup, photo)
+            return
+        elif photo is None:
+            await message.edit_text(text, reply_markup=reply_markup)
+        elif photo == current_photo:
+            await message.edit_caption(caption=text, reply_markup=reply_markup)
         else:
-            await query.edit_message_text("❌ Турнир не найден")
-        await show_admin_tournaments(query, context)
+            await message.edit_media(InputMediaPhoto(photo, caption=text), reply_markup=reply_markup)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+    views.put(key, fingerprint, photo)
+
+async def replace_view(query, message, key, text, reply_markup, photo):
+    """Заменяет сообщение новым: текстовое на фото или наоборот"""
+    bot = message.get_bot()
+    if photo is None:
+        new_message = await bot.send_message(message.chat_id, text, reply_markup=reply_markup)
+    else:
+        new_message = await bot.send_photo(message.chat_id, photo, caption=text, reply_markup=reply_markup)
+    views.forget(key)
+    try:
+        await message.delete()
+    except BadRequest:
+        # Сообщения старше 48 часов бот удалить не может — оно останется выше со своими кнопками,
+        # и следующие нажатия на них должны править его самого
+        pass
+    else:
+        views.move(query, new_message)
+    views.put((new_message.chat_id, new_message.message_id), views.fingerprint(text, reply_markup, photo), photo)
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /start; /start reg_<турнир> — запись по ссылке из inline режима"""
+    if context.args and context.args[0].startswith('reg_'):
+        tournament_id = context.args[0][len('reg_'):]
+        if await db.get_tournament(tournament_id):
+            await begin_registration(update.message, context, tournament_id)
+            return
+        await update.message.reply_text("❌ Турнир не найден")
+    
+    reply_markup = START_MARKUP_ADMIN if is_staff(update.effective_user) else START_MARKUP
+    await update.message.reply_text(WELCOME_TEXT, reply_markup=reply_markup)
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inline режим: @бот <название турнира>"""
+    query = update.inline_query
+    results = await inline_search.results(query.query, context.bot.username)
+    await query.answer(results, cache_time=INLINE_CACHE_TIME)
+
+async def grant_role(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /grant <user_id> [admin|moderator] — выдает роль (по умолчанию модератор)"""
+    if not is_admin(update.effective_user):
+        return
+    try:
+        user_id = int(context.args[0])
+        role = context.args[1] if len(context.args) > 1 else ROLE_MODERATOR
+        if role not in ROLE_LEVELS:
+            raise ValueError(role)
+    except (IndexError, ValueError):
+        await update.message.reply_text("❌ Используйте: /grant user_id [admin|moderator]")
+        return
     
-    elif data.startswith("participants_"):
-        tournament_id = data.replace("participants_", "")
-        await show_participants_list(query, context, tournament_id)
+    if role != ROLE_ADMIN and roles.admins() == [user_id]:
+        await update.message.reply_text("❌ Нельзя понизить последнего админа")
+        return
+    await roles.grant(user_id, role)
+    await update.message.reply_text(f"✅ Пользователь {user_id} теперь {role}")
+
+async def revoke_role(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /revoke <user_id> — снимает роль"""
+    if not is_admin(update.effective_user):
+        return
+    try:
+        user_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("❌ Используйте: /revoke user_id")
+        return
     
-    elif data == "back_to_start":
-        user = query.from_user
-        is_admin = user.username and user.username.lower() == ADMIN_USERNAME.lower()
-        
-        keyboard = [
-            [InlineKeyboardButton("Меню", callback_data="menu")],
-            [InlineKeyboardButton("Связь с менеджером", url=f"https://t.me/{ADMIN_USERNAME}")],
-            [InlineKeyboardButton("Наш телеграм канал", url="https://t.me/RingingTournament")],
-            [InlineKeyboardButton("Уведомления", callback_data="notifications")]
-        ]
-        
-        if is_admin:
-            keyboard.insert(1, [InlineKeyboardButton("Админ панель", callback_data="admin_panel")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        welcome_text = (
-            "Привет, ты попал в Ringing Tournament 📡\n"
-            "Воспользуйся кнопками ниже чтобы ознакомиться с интерфейсом бота."
+    if roles.admins() == [user_id]:
+        await update.message.reply_text("❌ Нельзя снять роль с последнего админа")
+        return
+    if await roles.revoke(user_id):
+        await update.message.reply_text(f"✅ Роль пользователя {user_id} снята")
+    else:
+        await update.message.reply_text(f"❌ У пользователя {user_id} нет роли")
+
+async def search_participants(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /search [id турнира] <текст> — поиск участников по нику, ID в игре или username"""
+    if not is_staff(update.effective_user):
+        return
+    args = list(context.args)
+    tournament_id = None
+    if args and await db.get_tournament(args[0]):
+        tournament_id = args.pop(0)
+    if not args:
+        await update.message.reply_text("❌ Используйте: /search [id турнира] ник, ID в игре или @username")
+        return
+    await reply_search_results(update.message, " ".join(args), tournament_id)
+
+async def list_roles(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /roles — список админов и модераторов"""
+    if not is_admin(update.effective_user):
+        return
+    rows = await db.get_roles()
+    lines = ["👮 Роли:"] + [f"{user_id} — {role}" for user_id, role in rows]
+    await update.message.reply_text("\n".join(lines))
+
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик нажатий на инлайн кнопки"""
+    # Ответ на нажатие отправляет роутер: отказ в доступе показывается всплывающим окном
+    await router.dispatch(update.callback_query, context)
+
+@router.route("menu")
+async def on_menu(query, context):
+    await query.delete_message()
+    views.forget(views.key(query))
+    await show_menu(query, context)
+
+@router.route("notifications")
+async def on_notifications(query, context):
+    await edit_view(query, "🔔 Настройки уведомлений будут здесь")
+
+@router.route("add_tournament", role=ROLE_ADMIN)
+async def on_add_tournament(query, context):
+    await edit_view(query, "Введите название турнира:")
+    context.user_data['waiting_for_tournament_name'] = True
+
+@router.route("bc", role=ROLE_ADMIN)
+async def on_broadcast(query, context, tournament_id):
+    tournament = await db.get_tournament(tournament_id)
+    if not tournament:
+        await edit_view(query, "❌ Турнир не найден")
+        return
+    await edit_view(query, f"📢 Введите текст рассылки для участников турнира «{tournament['name']}»:")
+    context.user_data['waiting_for_broadcast_text'] = tournament_id
+
+@router.route("links", role=ROLE_ADMIN)
+async def on_upload_links(query, context, tournament_id):
+    tournament = await db.get_tournament(tournament_id)
+    if not tournament:
+        await edit_view(query, "❌ Турнир не найден")
+        return
+    await edit_view(
+        query,
+        f"🔗 Отправьте файл со ссылками на матч для турнира «{tournament['name']}».\n"
+        "Каждая строка: user_id или ник участника, затем ссылка (через запятую, точку с запятой или табуляцию)"
+    )
+    context.user_data['waiting_for_links_file'] = tournament_id
+
+@router.route("link")
+async def on_match_link(query, context, tournament_id):
+    link = await db.get_match_link(tournament_id, query.from_user.id)
+    text = f"🔗 Твоя ссылка на матч:\n{link}" if link else "🔗 Ссылка на матч пока не выдана, загляни позже"
+    await edit_view(query, text, reply_markup=InlineKeyboardMarkup([
+        [InlineKeyboardButton("Назад", callback_data=cb("t", tournament_id, "g"))]
+    ]))
+
+@router.route("send_message", role=ROLE_ADMIN)
+async def on_send_message(query, context):
+    await edit_view(query, "Введите ID пользователя и сообщение в формате: user_id текст сообщения")
+    context.user_data['waiting_for_user_message'] = True
+
+@router.route("del", role=ROLE_ADMIN)
+async def on_delete(query, context, tournament_id):
+    if await db.delete_tournament(tournament_id):
+        await edit_view(query, "✅ Турнир удален!")
+    else:
+        await edit_view(query, "❌ Турнир не найден")
+    await show_admin_tournaments(query, context)
+
+@router.route("done", role=ROLE_ADMIN)
+async def on_complete(query, context, tournament_id):
+    if await db.complete_tournament(tournament_id):
+        await edit_view(query, "✅ Турнир завершен!")
+    else:
+        await edit_view(query, "❌ Турнир не найден")
+    await show_admin_tournaments(query, context)
+
+@router.route("pl", role=ROLE_MODERATOR)
+async def on_participants(query, context, tournament_id, start=1, direction="n", cursor_id=None):
+    # pl:<турнир>[:<номер первой записи>:<n|p>:<id регистрации>]
+    await show_participants_list(
+        query, context, tournament_id,
+        start=int(start),
+        cursor_id=int(cursor_id) if cursor_id else None,
+        backward=direction == "p"
+    )
+
+@router.route("back_to_start")
+async def on_back_to_start(query, context):
+    reply_markup = START_MARKUP_ADMIN if is_staff(query.from_user) else START_MARKUP
+    await edit_view(query, WELCOME_TEXT, reply_markup=reply_markup)
+
+def render_participants(header, registrations, start_number, limit=MESSAGE_LIMIT, tournaments=None):
+    """Собирает текст страницы участников, не выходя за лимит длины сообщения.
+    
+    tournaments (id -> турнир) — показать у каждой записи её турнир, например в поиске.
+    Возвращает текст и количество поместившихся записей.
+    """
+    parts = [header]
+    length = len(header)
+    rendered = 0
+    
+    for number, reg in enumerate(registrations, start_number):
+        entry = (
+            f"{number}. 🎮 Ник: {reg[4]}\n"
+            f"   🆔 ID в игре: {reg[5]}\n"
+            f"   👤 TG: @{reg[3] if reg[3] else 'скрыт'} (ID: {reg[2]})\n"
+            f"   📅 Зарегистрирован: {reg[6][:10]}\n\n"
         )
-        
-        await query.edit_message_text(welcome_text, reply_markup=reply_markup)
+        if tournaments is not None:
+            tournament = tournaments.get(reg[1])
+            entry = entry[:-1] + f"   🏆 {tournament['name'] if tournament else reg[1]}\n\n"
+        if rendered and length + len(entry) > limit:
+            break
+        parts.append(entry)
+        length += len(entry)
+        rendered += 1
+    
+    return "".join(parts)[:limit], rendered
 
-async def show_participants_list(query, context, tournament_id):
-    """Показывает список участников турнира"""
-    tournament = db.get_tournament(tournament_id)
+async def show_participants_list(query, context, tournament_id, start=1, cursor_id=None, backward=False):
+    """Показывает страницу списка участников турнира"""
+    tournament = await db.get_tournament(tournament_id)
     if not tournament:
-        await query.edit_message_text("❌ Турнир не найден")
+        await edit_view(query, "❌ Турнир не найден")
         return
     
-    registrations = db.get_registrations(tournament_id)
+    registrations, has_more = await db.get_registrations_page(tournament_id, cursor_id, backward)
+    
+    # При движении назад номер первой записи известен только после выборки
+    if backward:
+        start = max(start - len(registrations), 1)
+    
+    keyboard = []
     
     if not registrations:
         text = f"📋 Список участников турнира: {tournament['name']}\n\n❌ Нет зарегистрированных участников"
     else:
-        text = f"📋 Список участников турнира: {tournament['name']}\n\n"
+        header = f"📋 Список участников турнира: {tournament['name']}\n👥 Всего: {tournament['participants']}\n\n"
+        text, rendered = render_participants(header, registrations, start)
         
-        for i, reg in enumerate(registrations, 1):
-            text += f"{i}. 🎮 Ник: {reg[4]}\n"
-            text += f"   🆔 ID в игре: {reg[5]}\n"
-            text += f"   👤 TG: @{reg[3] if reg[3] else 'скрыт'} (ID: {reg[2]})\n"
-            text += f"   📅 Зарегистрирован: {reg[6][:10]}\n\n"
+        navigation = []
+        if start > 1:
+            navigation.append(InlineKeyboardButton(
+                "◀️", callback_data=cb("pl", tournament_id, start, "p", registrations[0][0])
+            ))
+        if backward or has_more or rendered < len(registrations):
+            navigation.append(InlineKeyboardButton(
+                "▶️", callback_data=cb("pl", tournament_id, start + rendered, "n", registrations[rendered - 1][0])
+            ))
+        if navigation:
+            keyboard.append(navigation)
     
-    keyboard = [
-        [InlineKeyboardButton("⬅️ Назад к турниру", callback_data=f"admin_tournament_{tournament_id}")],
-        [InlineKeyboardButton("📊 Все турниры", callback_data="view_tournaments")]
-    ]
+    keyboard.append([InlineKeyboardButton("⬅️ Назад к турниру", callback_data=cb("at", tournament_id))])
+    keyboard.append([InlineKeyboardButton("📊 Все турниры", callback_data=cb("view_tournaments"))])
+    
+    await edit_view(query, text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+@router.route("arch", role=ROLE_MODERATOR)
+async def show_archive(query, context, direction="n", cursor_id=None):
+    """Показывает страницу архива турниров: arch[:<n|p>:<id записи архива>]"""
+    backward = direction == "p"
+    rows, has_more = await db.get_archive_page(int(cursor_id) if cursor_id else None, backward)
+    
+    if not rows:
+        text = "🗄 Архив пуст"
+    else:
+        lines = ["🗄 Архив турниров:\n"]
+        for _, _, name, date, participants, _ in rows:
+            lines.append(f"• {name} — {date}, участников: {participants}")
+        text = "\n".join(lines)
+    
+    # Страницы идут от новых к старым: "◀️" — к более новым, "▶️" — к более старым
+    has_newer = has_more if backward else cursor_id is not None
+    has_older = backward or has_more
+    keyboard = []
+    navigation = []
+    if rows and has_newer:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=cb("arch", "p", rows[0][0])))
+    if rows and has_older:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=cb("arch", "n", rows[-1][0])))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton("Назад", callback_data=cb("admin_panel"))])
+    
+    await edit_view(query, text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+@router.route("find", role=ROLE_MODERATOR)
+async def on_search_participants(query, context, tournament_id):
+    tournament = await db.get_tournament(tournament_id)
+    if not tournament:
+        await edit_view(query, "❌ Турнир не найден")
+        return
+    await edit_view(query, f"🔍 Введите ник, ID в игре или @username участника турнира «{tournament['name']}»:")
+    context.user_data['waiting_for_search'] = tournament_id
+
+async def reply_search_results(message, text, tournament_id=None):
+    """Отвечает найденными участниками"""
+    registrations, total = await db.search_registrations(text, tournament_id)
+    if not registrations:
+        await message.reply_text("🔍 Никого не нашлось")
+        return
+    
+    found = f"{total}+" if total >= SEARCH_COUNT_LIMIT else total
+    header = f"🔍 Найдено: {found}" + (f", показаны первые {len(registrations)}" if total > len(registrations) else "") + "\n\n"
+    tournaments = None if tournament_id else await db.get_tournaments(active_only=False)
+    text, _ = render_participants(header, registrations, 1, tournaments=tournaments)
+    await message.reply_text(text)
+
+@router.route("exp", role=ROLE_MODERATOR)
+async def send_registrations_export(query, context, fmt, tournament_id):
+    """Отправляет админу файл с регистрациями турнира (или всех турниров)"""
+    if fmt not in ('csv', 'jsonl'):
+        return
+    
+    if tournament_id == 'all':
+        tournament_id = None
+        filename = f"registrations.{fmt}"
+    else:
+        if not await db.get_tournament(tournament_id):
+            await edit_view(query, "❌ Турнир не найден")
+            return
+        filename = f"{tournament_id}_registrations.{fmt}"
     
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    export = await db.export_registrations(fmt, tournament_id)
+    try:
+        # У файла в памяти нет имени на диске, поэтому передаем содержимое через InputFile с явным именем
+        await query.message.reply_document(document=InputFile(export.read(), filename=filename))
+    finally:
+        export.close()
 
+@router.route("reg")
 async def start_registration(query, context, tournament_id):
     """Начинает процесс регистрации на турнир"""
-    if not db.get_tournament(tournament_id):
-        await query.edit_message_text("❌ Турнир не найден")
+    if not await db.get_tournament(tournament_id):
+        await edit_view(query, "❌ Турнир не найден")
         return
-    
+    await begin_registration(query.message, context, tournament_id)
+
+async def begin_registration(message, context, tournament_id):
+    """Просит ник и айди для записи на турнир"""
     context.user_data['registering_for_tournament'] = tournament_id
     context.user_data['waiting_for_nickname_id'] = True
     
@@ -369,169 +2582,168 @@ async def start_registration(query, context, tournament_id):
         "📅 ОБЯЗАТЕЛЬНО: Если ты введёшь неправильный ID, то это дисквалификация!"
     )
     
-    await query.message.reply_text(instruction_text)
+    await message.reply_text(instruction_text)
 
+@router.route("t")
 async def show_tournament_details(query, context, tournament_id, from_my_games=False):
-    """Показывает детальную информацию о турнире"""
-    tournament = db.get_tournament(tournament_id)
+    """Показывает детальную информацию о турнире; t:<турнир>:g — открыт из "Моих игр" """
+    tournament = await db.get_tournament(tournament_id)
     
     if tournament:
-        status_emoji = "✅" if tournament['status'] == 'active' else "🏁"
-        info_text = (
-            f"🏆 {tournament['name']} {status_emoji}\n\n"
-            f"📝 {tournament['description']}\n"
-            f"📅 Дата: {tournament['date']}\n"
-            f"💰 Призовой фонд: {tournament['prize']}\n"
-            f"💵 Стоимость участия: {tournament['entry_fee']}\n"
-            f"👥 Участников: {tournament['participants']}/{tournament['max_participants']}\n"
-            f"📊 Статус: {'Активный' if tournament['status'] == 'active' else 'Завершен'}"
-        )
-        
-        if from_my_games or query.data == "tournament_info":
-            back_callback = "my_games"
-        else:
-            back_callback = "tournaments"
-        
-        keyboard = []
-        
-        if not from_my_games and query.data != "tournament_info" and tournament['status'] == 'active':
-            keyboard.append([InlineKeyboardButton("📝 Записаться", callback_data=f"register_{tournament_id}")])
-        
-        keyboard.append([InlineKeyboardButton("Назад", callback_data=back_callback)])
-        
-        await query.edit_message_text(
-            info_text, 
-            reply_markup=InlineKeyboardMarkup(keyboard)
+        card = cards.card(tournament)
+        await edit_view(
+            query, card['text'],
+            reply_markup=card['my_games_markup'] if from_my_games else card['markup'],
+            photo=card['photo']
         )
     else:
-        keyboard = [[InlineKeyboardButton("Назад", callback_data="my_games")]]
-        await query.edit_message_text(
-            "❌ Турнир не найден", 
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        await edit_view(query, "❌ Турнир не найден", reply_markup=BACK_TO_MY_GAMES_MARKUP)
 
+@router.route("at", role=ROLE_MODERATOR)
 async def show_admin_tournament_details(query, context, tournament_id):
     """Показывает детальную информацию о турнире для админа"""
-    tournament = db.get_tournament(tournament_id)
+    tournament = await db.get_tournament(tournament_id)
     
     if tournament:
-        status_emoji = "✅" if tournament['status'] == 'active' else "🏁"
-        info_text = (
-            f"🏆 {tournament['name']} {status_emoji}\n\n"
-            f"📝 {tournament['description']}\n"
-            f"📅 Дата: {tournament['date']}\n"
-            f"💰 Призовой фонд: {tournament['prize']}\n"
-            f"💵 Стоимость участия: {tournament['entry_fee']}\n"
-            f"👥 Участников: {tournament['participants']}/{tournament['max_participants']}\n"
-            f"📊 Статус: {'Активный' if tournament['status'] == 'active' else 'Завершен'}"
-        )
-        
-        keyboard = []
-        
-        if tournament['status'] == 'active':
-            keyboard.append([InlineKeyboardButton("🏁 Завершить турнир", callback_data=f"complete_{tournament_id}")])
-        
-        keyboard.append([InlineKeyboardButton("❌ Удалить турнир", callback_data=f"delete_{tournament_id}")])
-        keyboard.append([InlineKeyboardButton("📋 Список участников", callback_data=f"participants_{tournament_id}")])
-        keyboard.append([InlineKeyboardButton("Назад", callback_data="view_tournaments")])
-        
-        await query.edit_message_text(
-            info_text, 
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        card = cards.card(tournament)
+        await edit_view(query, card['text'], reply_markup=card['admin_markup'], photo=card['photo'])
     else:
-        keyboard = [[InlineKeyboardButton("Назад", callback_data="view_tournaments")]]
-        await query.edit_message_text(
-            "❌ Турнир не найден", 
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        await edit_view(query, "❌ Турнир не найден", reply_markup=BACK_TO_ADMIN_TOURNAMENTS_MARKUP)
 
+@router.route("back_to_menu")
 async def show_menu(query, context):
     """Показывает главное меню"""
-    keyboard = [
-        [InlineKeyboardButton("Турниры", callback_data="tournaments")],
-        [InlineKeyboardButton("Мои игры", callback_data="my_games")],
-        [InlineKeyboardButton("Назад", callback_data="back_to_start")]
-    ]
-    
-    await query.message.reply_text(
-        "Ringing Tournament",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    await query.message.reply_text("Ringing Tournament", reply_markup=MENU_MARKUP)
 
+@router.route("tournaments")
 async def show_tournaments(query, context):
     """Показывает список турниров"""
-    tournaments = db.get_tournaments()
+    reply_markup = await cards.tournament_list()
     
-    if not tournaments:
-        keyboard = [[InlineKeyboardButton("Назад", callback_data="menu")]]
-        await query.edit_message_text(
-            "🏆 На данный момент нет активных турниров",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+    if reply_markup is None:
+        await edit_view(query, "🏆 На данный момент нет активных турниров", reply_markup=BACK_TO_MENU_MARKUP)
         return
     
-    keyboard = []
-    for tournament_id, tournament in tournaments.items():
-        status_emoji = "✅" if tournament['status'] == 'active' else "🏁"
-        keyboard.append([InlineKeyboardButton(f"{tournament['name']} {status_emoji}", callback_data=tournament_id)])
-    
-    keyboard.append([InlineKeyboardButton("Назад", callback_data="menu")])
-    
-    await query.edit_message_text(
-        "🏆 Выберите турнир:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    await edit_view(query, "🏆 Выберите турнир:", reply_markup=reply_markup)
 
+@router.route("my_games")
+@router.route("back_to_games")
+# Кнопка "О турнире" из старых сообщений
+@router.route("tournament_info")
 async def show_my_games(query, context):
-    """Показывает меню 'Мои игры'"""
+    """Показывает турниры, на которые записан пользователь"""
+    tournaments = await db.get_user_tournaments(query.from_user.id)
+    if not tournaments:
+        await edit_view(query, "🎮 Ты пока не записан ни на один турнир", reply_markup=BACK_TO_MENU_MARKUP)
+        return
+    
     keyboard = [
-        [InlineKeyboardButton("О турнире", callback_data="tournament_info")],
-        [InlineKeyboardButton("Назад", callback_data="menu")]
+        [InlineKeyboardButton(
+            f"{t['name']} {STATUS_LABELS.get(t['status'], STATUS_LABELS['completed'])[0]}",
+            callback_data=cb("t", t['id'], "g")
+        )]
+        for t in tournaments
     ]
-    
-    await query.edit_message_text(
-        "🎮 Мои игры",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    keyboard.append([InlineKeyboardButton("Назад", callback_data=cb("menu"))])
+    await edit_view(query, "🎮 Мои игры:", reply_markup=InlineKeyboardMarkup(keyboard))
 
+@router.route("admin_panel", role=ROLE_MODERATOR)
 async def show_admin_panel(query, context):
     """Показывает админ панель"""
-    keyboard = [
-        [InlineKeyboardButton("Добавить турнир", callback_data="add_tournament")],
-        [InlineKeyboardButton("Просмотреть турниры", callback_data="view_tournaments")],
-        [InlineKeyboardButton("📨 Отправить сообщение", callback_data="send_message")],
-        [InlineKeyboardButton("Назад", callback_data="menu")]
-    ]
-    
-    await query.edit_message_text(
-        "⚙️ Админ панель",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    await edit_view(query, "⚙️ Админ панель", reply_markup=ADMIN_PANEL_MARKUP)
 
+@router.route("view_tournaments", role=ROLE_MODERATOR)
 async def show_admin_tournaments(query, context):
     """Показывает турниры в админ панели"""
-    tournaments = db.get_tournaments(active_only=False)
+    text, reply_markup = await cards.admin_list()
+    await edit_view(query, text, reply_markup=reply_markup)
+
+def parse_links_file(data):
+    """Разбирает файл со ссылками: строки "<user_id или ник><разделитель><ссылка>".
     
-    if not tournaments:
-        text = "❌ Нет созданных турниров"
-        keyboard = [[InlineKeyboardButton("Назад", callback_data="admin_panel")]]
-    else:
-        text = "🏆 Все турниры:\n\n"
-        keyboard = []
-        for tournament_id, tournament in tournaments.items():
-            status_text = "✅ Активный" if tournament['status'] == 'active' else "🏁 Завершен"
-            text += f"• {tournament['name']} ({status_text})\n"
-            keyboard.append([InlineKeyboardButton(f"📋 {tournament['name']}", callback_data=f"admin_tournament_{tournament_id}")])
-        
-        keyboard.append([InlineKeyboardButton("Назад", callback_data="admin_panel")])
+    Возвращает (список (ник или user_id строкой, ссылка), число пропущенных строк).
+    Что это — ник или ID, решает assign_match_links по участникам турнира.
+    """
+    text = data.decode('utf-8-sig', errors='replace')
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
     
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    rows = []
+    skipped = 0
+    for record in csv.reader(io.StringIO(text), dialect):
+        if len(record) < 2 or not record[1].strip().startswith(('http://', 'https://', 'tg://')):
+            # Заголовок, пустые и битые строки
+            skipped += 1 if any(field.strip() for field in record) else 0
+            continue
+        rows.append((record[0].strip(), record[1].strip()))
+    return rows, skipped
+
+async def assign_links_from_file(update, context, tournament_id):
+    """Раздает участникам ссылки на матч из присланного админом файла"""
+    document = update.message.document
+    if document.file_size and document.file_size > LINKS_FILE_LIMIT:
+        await update.message.reply_text("❌ Файл слишком большой")
+        return
+    
+    file = await document.get_file()
+    rows, skipped = parse_links_file(bytes(await file.download_as_bytearray()))
+    if not rows:
+        await update.message.reply_text("❌ В файле не найдено ни одной ссылки")
+        return
+    
+    assigned, unknown = await db.assign_match_links(tournament_id, rows)
+    text = f"✅ Ссылки выданы: {assigned}"
+    if skipped:
+        text += f"\n⚠️ Пропущено строк: {skipped}"
+    if unknown:
+        text += f"\n❓ Не найдены среди участников ({len(unknown)}): " + ", ".join(unknown[:20])
+        if len(unknown) > 20:
+            text += " …"
+    await update.message.reply_text(text)
+
+# Состояния сценариев, доступных только админу
+ADMIN_STATE_KEYS = (
+    'waiting_for_broadcast_text', 'waiting_for_user_message', 'waiting_for_links_file', 'new_tournament',
+    'waiting_for_tournament_name', 'waiting_for_tournament_description', 'waiting_for_tournament_date',
+    'waiting_for_tournament_entry_fee', 'waiting_for_tournament_max_participants',
+    'waiting_for_tournament_photo', 'waiting_for_tournament_prize',
+)
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений и фото"""
     user = update.effective_user
     
+    # Если права отозвали посреди сценария, он не продолжается
+    if not is_admin(user):
+        for key in ADMIN_STATE_KEYS:
+            context.user_data.pop(key, None)
+    
+    # Файл со ссылками на матч
+    if update.message.document:
+        tournament_id = context.user_data.pop('waiting_for_links_file', None)
+        if tournament_id:
+            await assign_links_from_file(update, context, tournament_id)
+        return
+    
+    # Поиск участника турнира
+    if context.user_data.get('waiting_for_search'):
+        tournament_id = context.user_data.pop('waiting_for_search')
+        if update.message.text and is_staff(user):
+            await reply_search_results(update.message, update.message.text, tournament_id)
+        return
+    
+    # Обработка рассылки участникам турнира
+    if context.user_data.get('waiting_for_broadcast_text'):
+        tournament_id = context.user_data.pop('waiting_for_broadcast_text')
+        if not update.message.text:
+            await update.message.reply_text("❌ Рассылка поддерживает только текст")
+            return
+        recipients = await broadcaster.start(context.bot, tournament_id, update.message.text)
+        await update.message.reply_text(f"📢 Рассылка запущена, получателей: {recipients}")
+        return
+    
     # Обработка отправки сообщения пользователю
     if context.user_data.get('waiting_for_user_message'):
         try:
@@ -557,7 +2769,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.user_data.get('waiting_for_nickname_id'):
         tournament_id = context.user_data.get('registering_for_tournament')
         
-        tournament = db.get_tournament(tournament_id)
+        tournament = await db.get_tournament(tournament_id)
         if tournament:
             message_text = update.message.text
             parts = message_text.split(' и ')
@@ -567,7 +2779,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 user_id = parts[1].strip()
                 
                 # Пытаемся зарегистрировать
-                success, message = db.add_registration(
+                success, message = await db.add_registration(
                     tournament_id, 
                     user.id, 
                     user.username, 
@@ -583,25 +2795,15 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         f"🆔 Твой ID: {user_id}"
                     )
                     
-                    # УВЕДОМЛЕНИЕ АДМИНУ
-                    try:
-                        admin_text = (
-                            f"НОВАЯ ЗАПИСЬ НА ТУРНИР!\n"
-                            f"Турнир: {tournament['name']}\n"
-                            f"ID TG: {user.id}\n"
-                            f"Username: @{user.username if user.username else 'нет'}\n"
-                            f"Ник: {nickname}\n"
-                            f"ID в игре: {user_id}"
-                        )
-                        
-                        await context.bot.send_message(
-                            chat_id=ADMIN_CHAT_ID,
-                            text=admin_text
-                        )
-                        print("✅ УВЕДОМЛЕНИЕ ОТПРАВЛЕНО АДМИНУ!")
-                        
-                    except Exception as e:
-                        print(f"❌ ОШИБКА ОТПРАВКИ АДМИНУ: {e}")
+                    # УВЕДОМЛЕНИЕ АДМИНУ (уйдет сводкой в фоне)
+                    admin_notifier.notify(
+                        f"НОВАЯ ЗАПИСЬ НА ТУРНИР!\n"
+                        f"Турнир: {tournament['name']}\n"
+                        f"ID TG: {user.id}\n"
+                        f"Username: @{user.username if user.username else 'нет'}\n"
+                        f"Ник: {nickname}\n"
+                        f"ID в игре: {user_id}"
+                    )
                 else:
                     await update.message.reply_text(f"❌ {message}")
                 
@@ -638,10 +2840,18 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data['new_tournament']['description'] = message_text
         context.user_data['waiting_for_tournament_description'] = False
         context.user_data['waiting_for_tournament_date'] = True
-        await update.message.reply_text("📅 Введите дату турнира (например: 15.04.2024):")
+        await update.message.reply_text("📅 Введите дату и время начала турнира (например: 15.04.2024 18:00):")
     
     elif context.user_data.get('waiting_for_tournament_date'):
-        context.user_data['new_tournament']['date'] = message_text
+        starts_at = parse_start_time(message_text)
+        if starts_at is None:
+            await update.message.reply_text("❌ Не удалось разобрать дату. Формат: 15.04.2024 18:00 (время можно не указывать)")
+            return
+        if starts_at <= time.time():
+            await update.message.reply_text("❌ Эта дата уже прошла, введите дату начала турнира:")
+            return
+        context.user_data['new_tournament']['date'] = message_text.strip()
+        context.user_data['new_tournament']['starts_at'] = starts_at
         context.user_data['waiting_for_tournament_date'] = False
         context.user_data['waiting_for_tournament_entry_fee'] = True
         await update.message.reply_text("💵 Введите стоимость участия (например: 500 руб или Бесплатно):")
@@ -666,41 +2876,264 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data['new_tournament']['prize'] = message_text
         tournament = context.user_data['new_tournament']
         
-        tournament_id = f"tournament_{len(db.get_tournaments(active_only=False)) + 1}"
-        db.add_tournament(
-            tournament_id,
+        await db.add_tournament(
             tournament['name'],
             tournament['description'],
             tournament['date'],
             tournament['entry_fee'],
             tournament['prize'],
             tournament['max_participants'],
-            tournament.get('photo')
+            tournament.get('photo'),
+            starts_at=tournament.get('starts_at')
         )
+        await scheduler.reschedule()
         
         context.user_data.pop('new_tournament')
         context.user_data.pop('waiting_for_tournament_prize')
         
         await update.message.reply_text(f"✅ Турнир '{tournament['name']}' успешно создан!")
 
-def main():
-    """Запуск бота"""
-    try:
-        application = Application.builder().token(BOT_TOKEN).build()
-        
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CallbackQueryHandler(button_handler))
-        application.add_handler(MessageHandler(filters.TEXT | filters.PHOTO, handle_message))
+class UpdateQueue(asyncio.Queue):
+    """Очередь обновлений с обратным давлением.
+    
+    PTB забирает обновления из очереди и сразу создает для каждого задачу, а task_done вызывает
+    после обработки. Поэтому следующее обновление выдается, только когда в обработке меньше
+    max_pending: остальные ждут в очереди, а заполненная очередь заставляет ждать webhook
+    и long polling на put.
+    """
+    def __init__(self, maxsize=UPDATE_QUEUE_SIZE, max_pending=UPDATE_MAX_PENDING):
+        super().__init__(maxsize)
+        self.max_pending = max_pending
+        self.in_flight = 0
+        self._slot_freed = asyncio.Event()
+    
+    async def get(self):
+        # Забирает обновления один диспетчер, поэтому достаточно события
+        while self.in_flight >= self.max_pending:
+            self._slot_freed.clear()
+            await self._slot_freed.wait()
+        update = await super().get()
+        self.in_flight += 1
+        return update
+    
+    def task_done(self):
+        super().task_done()
+        # При остановке PTB отмечает и невыданные обновления — счетчик не уходит ниже нуля
+        if self.in_flight:
+            self.in_flight -= 1
+        self._slot_freed.set()
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления разных пользователей параллельно, а одного пользователя — строго по очереди.
+    
+    Сценарии в handle_message хранят состояние в user_data, поэтому два обновления
+    одного пользователя не должны выполняться одновременно. Очередь пользователя ждет
+    на своем замке до общего семафора, чтобы один пользователь не занимал чужие места.
+    """
+    def __init__(self, workers=UPDATE_WORKERS, max_pending=UPDATE_MAX_PENDING, key_pending=UPDATE_KEY_PENDING):
+        # Базовый семафор ограничивает число пользователей в обработке, свой — число выполняемых
+        super().__init__(max(max_pending, workers))
+        self.workers = workers
+        self.key_pending = key_pending
+        self._workers = None
+        # Ключ -> [замок, сколько обновлений его ждут или держат]
+        self._locks = {}
+        self.waiting = 0
+        self.processed = 0
+        self.dropped = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+    
+    async def initialize(self):
+        self._workers = asyncio.Semaphore(self.workers)
+    
+    async def shutdown(self):
+        pass
+    
+    @staticmethod
+    def _key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+    
+    async def process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
         
-        print("🤖 Бот запускается...")
-        print("🗄️ База данных SQLite подключена")
-        application.run_polling()
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        if self.key_pending and entry[1] >= self.key_pending:
+            # Пользователь уже прислал больше, чем мы успеваем обработать — лишнее не копим
+            coroutine.close()
+            await self._drop(key, update)
+            return
+        entry[1] += 1
         
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            async with entry[0]:
+                async with self._semaphore:
+                    await self.do_process_update(update, coroutine, started)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+    
+    async def _drop(self, key, update):
+        self.dropped += 1
+        print(f"⚠️ Отброшено обновление пользователя {key}: в его очереди уже {self.key_pending}")
+        if update.callback_query:
+            # Иначе кнопка у пользователя так и останется с часиками загрузки
+            try:
+                await update.callback_query.answer("⏳ Предыдущие действия ещё обрабатываются, попробуй позже")
+            except TelegramError:
+                pass
+    
+    async def do_process_update(self, update, coroutine, started=None):
+        if started is None:
+            started = time.monotonic()
+            self.waiting += 1
+        waiting = True
+        try:
+            # Место среди исполнителей занимаем только когда подошла очередь пользователя
+            async with self._workers:
+                waited = time.monotonic() - started
+                self.waiting -= 1
+                waiting = False
+                self.wait_time_total += waited
+                self.wait_time_max = max(self.wait_time_max, waited)
+                if metrics is not None:
+                    metrics.observe('bot_update_wait_seconds', waited)
+                try:
+                    await coroutine
+                finally:
+                    self.processed += 1
+        finally:
+            if waiting:
+                self.waiting -= 1
+    
+    def stats(self):
+        """Метрики очереди: сколько ждут, сколько обработано и время ожидания"""
+        return {
+            'waiting': self.waiting,
+            'active_keys': len(self._locks),
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'wait_time_avg': self.wait_time_total / self.processed if self.processed else 0.0,
+            'wait_time_max': self.wait_time_max,
+        }
+
+async def archive_job(context):
+    """Периодически переносит давно завершенные турниры в архив"""
+    completed_before = int(time.time() - ARCHIVE_AFTER_DAYS * 86400)
+    try:
+        archived = await db.archive_completed(completed_before)
+        if archived:
+            print(f"🗄 В архив перенесено турниров: {archived}")
     except Exception as e:
-        print(f"❌ Ошибка запуска бота: {e}")
-        import time
-        time.sleep(10)
-        main()
+        print(f"❌ Ошибка архивации: {e}")
+
+async def post_init(application):
+    """Действия после запуска приложения"""
+    admin_notifier.start(application.bot)
+    roles.start()
+    await broadcaster.resume(application.bot)
+    await scheduler.start(application)
+    if application.job_queue is not None:
+        application.job_queue.run_repeating(archive_job, interval=ARCHIVE_INTERVAL, first=60, name='archive')
+    if metrics is not None:
+        await metrics.start(METRICS_PORT, METRICS_HOST)
+
+async def post_shutdown(application):
+    """Действия перед остановкой приложения"""
+    await admin_notifier.stop(application.bot)
+    await roles.stop()
+    if metrics is not None:
+        await metrics.stop()
+
+def build_application(request=None):
+    """Создает приложение со всеми обработчиками.
+    
+    request позволяет подменить HTTP-клиент бота, например фейковым Telegram в бенчмарке.
+    """
+    processor = KeyedUpdateProcessor()
+    update_queue = UpdateQueue()
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .persistence(SQLitePersistence(db))
+        .update_queue(update_queue)
+        .concurrent_updates(processor)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    
+    if request is not None:
+        builder.request(request)
+    elif metrics is not None:
+        builder.request(InstrumentedRequest(connection_pool_size=256))
+    
+    if metrics is not None:
+        metrics.gauge('bot_updates_queued', update_queue.qsize)
+        metrics.gauge('bot_updates_in_flight', lambda: update_queue.in_flight)
+        metrics.gauge('bot_updates_waiting', lambda: processor.waiting)
+        metrics.gauge('bot_updates_processed', lambda: processor.processed)
+        metrics.gauge('bot_updates_dropped', lambda: processor.dropped)
+        metrics.gauge('bot_catalog_cache_hits', lambda: db.cache_hits)
+        metrics.gauge('bot_catalog_cache_misses', lambda: db.cache_misses)
+    
+    application = builder.build()
+    
+    application.add_handler(CommandHandler("start", timed_handler("start", start)))
+    application.add_handler(CommandHandler("grant", timed_handler("grant", grant_role)))
+    application.add_handler(CommandHandler("revoke", timed_handler("revoke", revoke_role)))
+    application.add_handler(CommandHandler("roles", timed_handler("roles", list_roles)))
+    application.add_handler(CommandHandler("search", timed_handler("search", search_participants)))
+    application.add_handler(CallbackQueryHandler(timed_handler("button_handler", button_handler)))
+    application.add_handler(InlineQueryHandler(timed_handler("inline_query", inline_query)))
+    application.add_handler(MessageHandler(filters.TEXT | filters.PHOTO | filters.Document.ALL, timed_handler("handle_message", handle_message)))
+    return application
+
+def main():
+    """Запуск бота"""
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+        print("❌ Для режима webhook нужно задать WEBHOOK_URL")
+        return
+    
+    # Перезапуск после ошибки — циклом, а не рекурсией
+    while True:
+        try:
+            application = build_application()
+            
+            print("🤖 Бот запускается...")
+            print("🗄️ База данных SQLite подключена")
+            # close_loop=False: при перезапуске используется тот же event loop
+            if BOT_MODE == 'webhook':
+                print(f"🌐 Режим webhook: {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+                application.run_webhook(
+                    listen=WEBHOOK_LISTEN,
+                    port=WEBHOOK_PORT,
+                    url_path=WEBHOOK_PATH,
+                    webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                    secret_token=WEBHOOK_SECRET,
+                    allowed_updates=Update.ALL_TYPES,
+                    close_loop=False
+                )
+            else:
+                application.run_polling(allowed_updates=Update.ALL_TYPES, close_loop=False)
+            # Штатная остановка (Ctrl+C, SIGTERM)
+            break
+            
+        except Exception as e:
+            print(f"❌ Ошибка запуска бота: {e}")
+            time.sleep(RESTART_DELAY)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
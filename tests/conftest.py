@@ -0,0 +1,144 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import pytest
+
+# БД тестов — во временной папке, до импорта бота
+os.environ['DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='bot_tests_'), 'test.db')
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+import bot
+
+
+class FakeTelegram(BaseRequest):
+    """Telegram API в памяти: запоминает вызовы с параметрами и файлами"""
+    def __init__(self):
+        self.calls = []
+        # Метод API -> текст ошибки, которой он ответит
+        self.errors = {}
+        self._message_id = 1000
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def endpoints(self):
+        return Counter(endpoint for endpoint, _, _ in self.calls)
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        files = request_data.multipart_data if request_data else None
+        self.calls.append((endpoint, params, files))
+
+        if endpoint in self.errors:
+            return 400, json.dumps({'ok': False, 'error_code': 400, 'description': self.errors[endpoint]}).encode()
+        if endpoint == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Test', 'username': 'test_bot'}
+        elif endpoint.startswith(('send', 'edit')):
+            self._message_id += 1
+            result = {
+                'message_id': self._message_id,
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 1)), 'type': 'private'},
+                'text': params.get('text') or params.get('caption') or '',
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+@pytest.fixture(scope='session')
+def run():
+    """Все тесты работают в одном event loop: объекты бота создаются один раз на модуль"""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.fixture(scope='session')
+def telegram():
+    return FakeTelegram()
+
+
+@pytest.fixture(scope='session')
+def application(run, telegram):
+    application = bot.build_application(request=telegram)
+    run(application.initialize())
+    yield application
+    run(application.shutdown())
+
+
+class Updates:
+    """Синтетические обновления от пользователей"""
+    def __init__(self, application):
+        self.application = application
+        self._update_id = 0
+
+    def _next(self):
+        self._update_id += 1
+        return self._update_id
+
+    @staticmethod
+    def user(user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': 'U', 'username': f'user{user_id}'}
+
+    def message(self, user_id, text):
+        update_id = self._next()
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self.user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return Update.de_json({'update_id': update_id, 'message': message}, self.application.bot)
+
+    def callback(self, user_id, data, message_id=None, photo=None):
+        update_id = self._next()
+        message = {
+            'message_id': message_id or update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+        }
+        if photo:
+            message['photo'] = [{'file_id': photo, 'file_unique_id': photo, 'width': 1, 'height': 1}]
+            message['caption'] = 'old'
+        else:
+            message['text'] = 'old'
+        return Update.de_json({
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self.user(user_id),
+                'chat_instance': 'test',
+                'data': data,
+                'message': message,
+            },
+        }, self.application.bot)
+
+
+@pytest.fixture(scope='session')
+def updates(application):
+    return Updates(application)
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Отдельная синхронная БД на тест"""
+    database = bot.Database(str(tmp_path / 'bot.db'))
+    yield database
+    database.conn.close()
@@ -0,0 +1,37 @@
+from telegram.error import Forbidden, TelegramError
+
+import bot
+
+
+class FakeBot:
+    def __init__(self, errors):
+        self.errors = errors
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        error = self.errors.get(chat_id)
+        if error:
+            raise error
+        self.sent.append(chat_id)
+
+
+def test_unexpected_api_error_does_not_abort_broadcast(run, database, monkeypatch):
+    notifier = bot.AdminNotifier(recipients=lambda: [])
+    monkeypatch.setattr(bot, 'admin_notifier', notifier)
+    tournament_id = database.add_tournament('Рассылка', '', '01.01.2030', '0', '0', 10)
+    for user_id in (1, 2, 3, 4):
+        database.add_registration(tournament_id, user_id, None, f'n{user_id}', f'g{user_id}')
+
+    async def scenario():
+        broadcaster = bot.Broadcaster(bot.AsyncDatabase(database), rate=1000, workers=2)
+        fake = FakeBot({2: TelegramError("Internal Server Error"), 3: Forbidden("bot was blocked by the user")})
+        broadcast_id, _ = await broadcaster.db.create_broadcast(tournament_id, "Старт через час")
+        await broadcaster.run(fake, broadcast_id, "Старт через час")
+        return fake.sent, broadcast_id
+
+    sent, broadcast_id = run(scenario())
+    assert sorted(sent) == [1, 4]
+    status = database.conn.execute('SELECT status FROM broadcasts WHERE id = ?', (broadcast_id,)).fetchone()[0]
+    assert status == 'done'
+    assert database.get_unfinished_broadcasts() == []
+    assert list(notifier._pending) == ["📢 Рассылка завершена\n✅ Отправлено: 2\n❌ Не доставлено: 2"]
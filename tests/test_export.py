@@ -0,0 +1,40 @@
+import csv
+import io
+import json
+
+import bot
+
+
+def sent_document(telegram):
+    """Содержимое последнего отправленного документа"""
+    documents = [files for endpoint, _, files in telegram.calls if endpoint == 'sendDocument']
+    assert documents, "документ не отправлен"
+    filename, content, _ = documents[-1]['document']
+    return filename, content
+
+
+def test_export_tournament_csv_is_sent_as_document(run, application, telegram, updates):
+    tournament_id = run(bot.db.add_tournament('Экспорт', '', '01.01.2030', '0', '0', 10))
+    run(bot.db.add_registration(tournament_id, 501, 'player', 'Ник', 'G1'))
+
+    telegram.calls.clear()
+    run(application.process_update(updates.callback(bot.ADMIN_CHAT_ID, bot.cb('exp', 'csv', tournament_id))))
+
+    filename, content = sent_document(telegram)
+    assert filename == f"{tournament_id}_registrations.csv"
+    rows = list(csv.reader(io.StringIO(content.decode('utf-8-sig'))))
+    assert rows[0] == bot.EXPORT_COLUMNS
+    assert rows[1][5] == 'Ник'
+
+
+def test_export_all_jsonl_is_sent_as_document(run, application, telegram, updates):
+    tournament_id = run(bot.db.add_tournament('Экспорт JSONL', '', '01.01.2030', '0', '0', 10))
+    run(bot.db.add_registration(tournament_id, 502, None, 'Nick', 'G2'))
+
+    telegram.calls.clear()
+    run(application.process_update(updates.callback(bot.ADMIN_CHAT_ID, bot.cb('exp', 'jsonl', 'all'))))
+
+    filename, content = sent_document(telegram)
+    assert filename == "registrations.jsonl"
+    records = [json.loads(line) for line in content.decode('utf-8').splitlines()]
+    assert {'tournament_id': tournament_id, 'nickname': 'Nick'}.items() <= records[-1].items()
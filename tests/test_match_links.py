@@ -0,0 +1,85 @@
+import bot
+
+
+def tournament(database, name, *players):
+    tournament_id = database.add_tournament(name, '', '01.01.2030', '0', '0', 10)
+    for user_id, nickname in players:
+        database.add_registration(tournament_id, user_id, None, nickname, f'G{user_id}')
+    return tournament_id
+
+
+def test_links_are_kept_per_tournament(database):
+    first = tournament(database, 'A', (1, 'Alpha'))
+    second = tournament(database, 'B', (1, 'Alpha'))
+
+    database.assign_match_links(first, [('Alpha', 'https://a.example/lobby')])
+    database.assign_match_links(second, [('1', 'https://b.example/lobby')])
+
+    assert database.get_match_link(first, 1) == 'https://a.example/lobby'
+    assert database.get_match_link(second, 1) == 'https://b.example/lobby'
+
+
+def test_numeric_nickname_is_not_taken_for_user_id(database):
+    tournament_id = tournament(database, 'C', (7, 'Seven'), (500, '007'))
+
+    links, unknown = database.assign_match_links(tournament_id, [('007', 'https://c.example/1')])
+
+    assert (links, unknown) == ([(500, 'https://c.example/1')], [])
+    assert database.get_match_link(tournament_id, 7) is None
+
+
+def test_user_ids_outside_tournament_are_reported(database):
+    tournament_id = tournament(database, 'D', (1, 'Alpha'))
+    other = tournament(database, 'E', (2, 'Beta'))
+
+    links, unknown = database.assign_match_links(
+        tournament_id, [('1', 'https://d.example/1'), ('2', 'https://d.example/2'), ('Nobody', 'https://d.example/3')]
+    )
+
+    assert links == [(1, 'https://d.example/1')]
+    assert unknown == ['2', 'Nobody']
+    assert database.get_match_link(other, 2) is None
+
+
+def test_parse_links_file_keeps_keys_as_text():
+    rows, skipped = bot.parse_links_file("id;link\n007;https://x.example/1\n42;https://x.example/2\n".encode())
+    assert rows == [('007', 'https://x.example/1'), ('42', 'https://x.example/2')]
+    assert skipped == 1
+
+
+def test_migration_keeps_unambiguous_user_links(tmp_path):
+    path = str(tmp_path / 'old.db')
+    database = bot.Database(path)
+    single = tournament(database, 'F', (1, 'Alpha'), (2, 'Beta'))
+    tournament(database, 'G', (2, 'Beta'))
+    with database.conn:
+        database.conn.execute('DROP TABLE match_links')
+        database.conn.executemany(
+            'INSERT INTO user_links (user_id, match_link) VALUES (?, ?)', [(1, 'https://old/1'), (2, 'https://old/2')]
+        )
+        database.conn.execute('PRAGMA user_version = 10')
+    database.conn.close()
+
+    database = bot.Database(path)
+    rows = database.conn.execute('SELECT tournament_id, user_id, match_link FROM match_links').fetchall()
+    database.conn.close()
+    # Игрок 2 записан на два турнира — к какому относится его ссылка, неизвестно
+    assert rows == [(single, 1, 'https://old/1')]
+
+
+def test_match_link_button_shows_link_of_that_tournament(run, application, telegram, updates):
+    first = run(bot.db.add_tournament('Ссылки A', '', '01.01.2030', '0', '0', 10))
+    second = run(bot.db.add_tournament('Ссылки B', '', '01.01.2030', '0', '0', 10))
+    for tournament_id in (first, second):
+        run(bot.db.add_registration(tournament_id, 900, None, 'Player', 'G900'))
+    run(bot.db.assign_match_links(first, [('Player', 'https://a.example/lobby')]))
+
+    telegram.calls.clear()
+    run(application.process_update(updates.callback(900, bot.cb('link', second))))
+    run(application.process_update(updates.callback(900, bot.cb('link', first))))
+
+    texts = [params['text'] for endpoint, params, _ in telegram.calls if endpoint == 'editMessageText']
+    assert texts == [
+        "🔗 Ссылка на матч пока не выдана, загляни позже",
+        "🔗 Твоя ссылка на матч:\nhttps://a.example/lobby",
+    ]
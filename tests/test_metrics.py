@@ -0,0 +1,36 @@
+import asyncio
+
+import bot
+
+
+def test_metrics_listen_on_localhost_by_default(run):
+    assert bot.METRICS_HOST == '127.0.0.1'
+
+    async def scenario():
+        metrics = bot.Metrics()
+        metrics.inc('bot_test_total')
+        await metrics.start(0)
+        try:
+            host, port = metrics._server.sockets[0].getsockname()[:2]
+            assert host == '127.0.0.1'
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+        finally:
+            await metrics.stop()
+        assert b"bot_test_total 1" in response
+
+    run(scenario())
+
+
+def test_application_exports_update_gauges(run, monkeypatch):
+    metrics = bot.Metrics()
+    monkeypatch.setattr(bot, 'metrics', metrics)
+
+    application = bot.build_application()
+    text = metrics.render()
+    assert 'bot_updates_queued 0' in text
+    assert 'bot_updates_in_flight 0' in text
+    assert application.update_queue.max_pending == bot.UPDATE_MAX_PENDING
@@ -0,0 +1,75 @@
+import asyncio
+
+import bot
+
+
+def open_persistence(path):
+    database = bot.AsyncDatabase(bot.Database(path))
+    return database, bot.SQLitePersistence(database)
+
+
+def test_state_survives_restart(run, tmp_path):
+    path = str(tmp_path / 'state.db')
+
+    async def scenario():
+        database, persistence = open_persistence(path)
+        await persistence.update_user_data(1, {'registration': 'tournament_1'})
+        await persistence.update_user_data(2, {'state': 'search'})
+        await persistence.drop_user_data(2)
+        await persistence.flush()
+        database.sync.conn.close()
+
+        # Перезапуск: новое соединение и пустая persistence
+        database, persistence = open_persistence(path)
+        first, second = {}, {}
+        await persistence.refresh_user_data(1, first)
+        await persistence.refresh_user_data(2, second)
+        database.sync.conn.close()
+        return first, second
+
+    assert run(scenario()) == ({'registration': 'tournament_1'}, {})
+
+
+def test_flush_waits_for_write_in_progress(run, tmp_path):
+    async def scenario():
+        database, persistence = open_persistence(str(tmp_path / 'state.db'))
+        save = database.save_user_states
+
+        async def slow_save(states):
+            await asyncio.sleep(0.2)
+            await save(states)
+
+        database.save_user_states = slow_save
+        await persistence.update_user_data(1, {'state': 'wizard'})
+        await asyncio.sleep(0.01)
+        # Фоновая запись уже идет — flush должен ее дождаться
+        await persistence.flush()
+        state = database.sync.get_user_state(1)
+        database.sync.conn.close()
+        return state
+
+    assert run(scenario()) == {'state': 'wizard'}
+
+
+def test_failed_write_keeps_states_for_next_flush(run, tmp_path, capsys):
+    async def scenario():
+        database, persistence = open_persistence(str(tmp_path / 'state.db'))
+        save = database.save_user_states
+        failures = [RuntimeError("database is locked")]
+
+        async def flaky_save(states):
+            if failures:
+                raise failures.pop()
+            await save(states)
+
+        database.save_user_states = flaky_save
+        await persistence.update_user_data(1, {'state': 'old'})
+        await asyncio.sleep(0.01)
+        await persistence.update_user_data(2, {'state': 'new'})
+        await persistence.flush()
+        states = database.sync.get_user_state(1), database.sync.get_user_state(2)
+        database.sync.conn.close()
+        return states
+
+    assert run(scenario()) == ({'state': 'old'}, {'state': 'new'})
+    assert "Ошибка сохранения состояний" in capsys.readouterr().out
@@ -0,0 +1,52 @@
+import bot
+
+
+def full_tournament(database):
+    tournament_id = database.add_tournament('Полный', '', '01.01.2030', '0', '0', 1)
+    assert database.add_registration(tournament_id, 1, 'first', 'Первый', 'G1') == (True, "Успешная регистрация")
+    return tournament_id
+
+
+def waitlist_size(database, tournament_id):
+    return database.conn.execute('SELECT COUNT(*) FROM waitlist WHERE tournament_id = ?', (tournament_id,)).fetchone()[0]
+
+
+def test_duplicate_registration_is_rejected(database):
+    tournament_id = database.add_tournament('Открытый', '', '01.01.2030', '0', '0', 10)
+    database.add_registration(tournament_id, 1, 'first', 'Первый', 'G1')
+
+    assert database.add_registration(tournament_id, 1, 'first', 'Первый', 'G1') == (
+        False, "Ты уже зарегистрирован на этот турнир"
+    )
+
+
+def test_duplicate_registration_on_full_tournament_skips_waitlist(database):
+    tournament_id = full_tournament(database)
+
+    assert database.add_registration(tournament_id, 1, 'first', 'Первый', 'G1') == (
+        False, "Ты уже зарегистрирован на этот турнир"
+    )
+    assert waitlist_size(database, tournament_id) == 0
+
+
+def test_new_user_on_full_tournament_goes_to_waitlist(database):
+    tournament_id = full_tournament(database)
+
+    ok, message = database.add_registration(tournament_id, 2, 'second', 'Второй', 'G2')
+    assert not ok
+    expected = "Все места заняты, ты в листе ожидания (№1)" if bot.WAITLIST_ENABLED else "Все места на турнир заняты"
+    assert message == expected
+
+
+def test_duplicate_registration_on_closed_tournament(database):
+    tournament_id = database.add_tournament('Закрытый', '', '01.01.2030', '0', '0', 10)
+    database.add_registration(tournament_id, 1, 'first', 'Первый', 'G1')
+    database.conn.execute("UPDATE tournaments SET status = 'closed' WHERE id = ?", (tournament_id,))
+
+    assert database.add_registration(tournament_id, 1, 'first', 'Первый', 'G1') == (
+        False, "Ты уже зарегистрирован на этот турнир"
+    )
+    assert database.add_registration(tournament_id, 2, 'second', 'Второй', 'G2') == (
+        False, "Запись на турнир закрыта"
+    )
+    assert waitlist_size(database, tournament_id) == 0
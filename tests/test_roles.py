@@ -0,0 +1,71 @@
+import bot
+from telegram.error import Forbidden, NetworkError
+
+
+def replies(telegram):
+    return [params['text'] for endpoint, params, _ in telegram.calls if endpoint == 'sendMessage']
+
+
+def test_last_admin_cannot_demote_themselves(run, application, telegram, updates):
+    assert bot.roles.admins() == [bot.ADMIN_CHAT_ID]
+
+    telegram.calls.clear()
+    run(application.process_update(updates.message(bot.ADMIN_CHAT_ID, f'/grant {bot.ADMIN_CHAT_ID} moderator')))
+
+    assert replies(telegram) == ["❌ Нельзя понизить последнего админа"]
+    assert bot.roles.has(bot.ADMIN_CHAT_ID, bot.ROLE_ADMIN)
+
+
+def test_admin_can_be_demoted_when_another_admin_exists(run, application, telegram, updates):
+    run(bot.roles.grant(42, bot.ROLE_ADMIN))
+    try:
+        telegram.calls.clear()
+        run(application.process_update(updates.message(bot.ADMIN_CHAT_ID, '/grant 42 moderator')))
+
+        assert replies(telegram) == ["✅ Пользователь 42 теперь moderator"]
+        assert not bot.roles.has(42, bot.ROLE_ADMIN)
+    finally:
+        run(bot.roles.revoke(42))
+
+
+class FakeBot:
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        error = self.errors.get(chat_id)
+        if error:
+            raise error
+        self.sent.append((chat_id, text))
+
+
+def test_notifier_sends_digest_to_every_admin(run):
+    notifier = bot.AdminNotifier(recipients=lambda: [1, 2, 3])
+    notifier.notify("первое")
+    notifier.notify("второе")
+
+    fake = FakeBot({2: Forbidden("bot was blocked by the user")})
+    run(notifier.flush(fake))
+
+    assert fake.sent == [(1, "первое\n\nвторое"), (3, "первое\n\nвторое")]
+    assert not notifier._pending
+
+
+def test_notifier_retries_only_admins_not_reached(run):
+    notifier = bot.AdminNotifier(recipients=lambda: [1, 2])
+    notifier.notify("уведомление")
+
+    fake = FakeBot({2: NetworkError("timeout")})
+    run(notifier.flush(fake))
+    assert fake.sent == [(1, "уведомление")]
+    assert len(notifier._pending) == 1
+
+    fake.errors.clear()
+    run(notifier.flush(fake))
+    assert fake.sent == [(1, "уведомление"), (2, "уведомление")]
+    assert not notifier._pending
+
+
+def test_notifier_defaults_to_current_admins():
+    assert bot.admin_notifier.recipients() == bot.roles.admins()
@@ -0,0 +1,29 @@
+import pytest
+
+import bot
+
+
+def test_cb_adds_version():
+    assert bot.cb('t', 'tournament_1') == f"{bot.CALLBACK_VERSION}|t:tournament_1"
+    assert bot.router.parse(bot.cb('pl', 'tournament_1', 21, 'n', 55)) == ('pl', ['tournament_1', '21', 'n', '55'])
+    assert bot.router.parse(bot.cb('tournaments')) == ('tournaments', [])
+
+
+def test_cb_respects_telegram_limit():
+    with pytest.raises(ValueError):
+        bot.cb('t', 'x' * bot.CALLBACK_DATA_LIMIT)
+
+
+@pytest.mark.parametrize('data, expected', [
+    # Кнопки без версии и старого формата из уже отправленных сообщений
+    ('t:tournament_1', ('t', ['tournament_1'])),
+    ('tournaments', ('tournaments', [])),
+    ('register_tournament_1', ('reg', ['tournament_1'])),
+    ('admin_tournament_tournament_1', ('at', ['tournament_1'])),
+    ('tournament_1', ('t', ['tournament_1'])),
+    # Неизвестная версия и маршрут
+    ('9|t:tournament_1', (None, [])),
+    ('nothing', (None, [])),
+])
+def test_parse_accepts_sent_buttons(data, expected):
+    assert bot.router.parse(data) == expected
@@ -0,0 +1,113 @@
+import asyncio
+
+import bot
+
+
+def test_user_backlog_does_not_block_other_users(run, updates):
+    async def scenario():
+        processor = bot.KeyedUpdateProcessor(workers=2, max_pending=2, key_pending=2)
+        await processor.initialize()
+        release = asyncio.Event()
+        done = []
+
+        async def handle(name, wait=False):
+            if wait:
+                await release.wait()
+            done.append(name)
+
+        tasks = [
+            asyncio.create_task(processor.process_update(updates.message(1, 'a1'), handle('a1', wait=True))),
+            asyncio.create_task(processor.process_update(updates.message(1, 'a2'), handle('a2'))),
+            asyncio.create_task(processor.process_update(updates.message(1, 'a3'), handle('a3'))),
+            asyncio.create_task(processor.process_update(updates.message(2, 'b1'), handle('b1'))),
+        ]
+        await asyncio.sleep(0.01)
+        # a2 ждет своей очереди без общего места, a3 сверх лимита пользователя — отброшено
+        assert done == ['b1']
+        assert processor.dropped == 1
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert done == ['b1', 'a1', 'a2']
+        assert processor.stats()['active_keys'] == 0
+
+    run(scenario())
+
+
+def test_user_updates_are_not_dropped_by_default(run, updates):
+    async def scenario():
+        processor = bot.KeyedUpdateProcessor(workers=2, max_pending=2)
+        await processor.initialize()
+        done = []
+
+        async def handle(name):
+            await asyncio.sleep(0)
+            done.append(name)
+
+        await asyncio.gather(*(
+            processor.process_update(updates.message(1, f'm{i}'), handle(i)) for i in range(20)
+        ))
+        return done, processor.dropped
+
+    assert run(scenario()) == (list(range(20)), 0)
+
+
+def test_dropped_callback_is_answered(run, telegram, updates, monkeypatch):
+    metrics = bot.Metrics()
+    monkeypatch.setattr(bot, 'metrics', metrics)
+
+    async def scenario():
+        processor = bot.KeyedUpdateProcessor(workers=1, max_pending=1, key_pending=1)
+        await processor.initialize()
+        release = asyncio.Event()
+
+        async def handle():
+            await release.wait()
+
+        first = asyncio.create_task(processor.process_update(updates.callback(7, bot.cb('menu')), handle()))
+        await asyncio.sleep(0.01)
+        telegram.calls.clear()
+        await processor.process_update(updates.callback(7, bot.cb('menu')), handle())
+        release.set()
+        await first
+        return processor.dropped
+
+    assert run(scenario()) == 1
+    (_, params), = [(e, p) for e, p, _ in telegram.calls if e == 'answerCallbackQuery']
+    assert "обрабатываются" in params['text']
+    # Время ожидания обработанного обновления попало в гистограмму
+    assert b'bot_update_wait_seconds_count 1' in metrics.render().encode()
+
+
+def test_update_queue_applies_backpressure(run):
+    async def scenario():
+        queue = bot.UpdateQueue(maxsize=1, max_pending=2)
+        release = asyncio.Event()
+
+        async def process(update):
+            await release.wait()
+            queue.task_done()
+
+        async def fetcher():
+            # Как Application._update_fetcher: задача на каждое обновление, task_done после обработки
+            while True:
+                update = await queue.get()
+                asyncio.create_task(process(update))
+
+        fetching = asyncio.create_task(fetcher())
+        for update in range(3):
+            await queue.put(update)
+        await asyncio.sleep(0.01)
+        # Два обновления в обработке, третье ждет в очереди, и следующий put ждет
+        assert (queue.in_flight, queue.qsize()) == (2, 1)
+        blocked = asyncio.create_task(queue.put(3))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+
+        release.set()
+        await asyncio.wait_for(blocked, 1)
+        await asyncio.wait_for(queue.join(), 1)
+        assert queue.in_flight == 0
+        fetching.cancel()
+
+    run(scenario())
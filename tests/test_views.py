@@ -0,0 +1,39 @@
+import bot
+
+
+def calls(telegram, *endpoints):
+    return [(endpoint, params) for endpoint, params, _ in telegram.calls if endpoint in endpoints]
+
+
+def test_replaced_message_is_edited_only_within_handler(run, application, telegram, updates):
+    tournament_id = run(bot.db.add_tournament('С обложкой', '', '01.01.2030', '0', '0', 10, photo_id='PHOTO'))
+
+    telegram.calls.clear()
+    run(application.process_update(updates.callback(bot.ADMIN_CHAT_ID, bot.cb('del', tournament_id), 500, 'PHOTO')))
+
+    (_, sent), = calls(telegram, 'sendMessage')
+    assert sent['text'] == "✅ Турнир удален!"
+    assert [params['message_id'] for _, params in calls(telegram, 'deleteMessage')] == [500]
+    # Список турниров после удаления правит уже новое сообщение
+    edits = calls(telegram, 'editMessageText')
+    assert edits and all(params['message_id'] != 500 for _, params in edits)
+    assert not bot.views._moved
+
+
+def test_message_that_could_not_be_deleted_keeps_its_buttons(run, application, telegram, updates):
+    tournament_id = run(bot.db.add_tournament('Старое сообщение', '', '01.01.2030', '0', '0', 10, photo_id='PHOTO'))
+    telegram.errors['deleteMessage'] = "Message can't be deleted"
+    try:
+        telegram.calls.clear()
+        run(application.process_update(updates.callback(bot.ADMIN_CHAT_ID, bot.cb('tournaments'), 600, 'PHOTO')))
+    finally:
+        telegram.errors.clear()
+    assert len(calls(telegram, 'sendMessage')) == 1
+
+    # Старое сообщение осталось: нажатие на его кнопку правит его самого, а не новое
+    telegram.calls.clear()
+    run(application.process_update(updates.callback(bot.ADMIN_CHAT_ID, bot.cb('at', tournament_id), 600, 'PHOTO')))
+
+    edits = calls(telegram, 'editMessageCaption', 'editMessageMedia', 'editMessageText')
+    assert [params['message_id'] for _, params in edits] == [600]
+    assert not calls(telegram, 'sendMessage', 'sendPhoto')